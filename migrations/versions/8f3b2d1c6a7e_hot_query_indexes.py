@@ -0,0 +1,73 @@
+"""hot query indexes
+
+Revision ID: 8f3b2d1c6a7e
+Revises: 368c74b0627e
+Create Date: 2026-10-18 12:05:11.402217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3b2d1c6a7e'
+down_revision = '368c74b0627e'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_post_user_id_date_id', 'post', ['user_id', 'date', 'id']),
+    ('ix_post_parent_id_date_id', 'post', ['parent_id', 'date', 'id']),
+    ('ix_like_post_id', 'like', ['post_id']),
+    ('ix_social_to_id_from_id', 'social', ['to_id', 'from_id']),
+]
+
+UNIQUE_CONSTRAINTS = [
+    ('uq_like_user_id_post_id', 'like', ['user_id', 'post_id']),
+    ('uq_social_from_id_to_id', 'social', ['from_id', 'to_id']),
+]
+
+
+def remove_duplicates(table, columns) -> None:
+    """Keeps the oldest row of every duplicated pair"""
+    op.execute(
+        f'DELETE FROM "{table}" WHERE id NOT IN '
+        f'(SELECT MIN(id) FROM "{table}" GROUP BY {", ".join(columns)})'
+    )
+
+
+def upgrade() -> None:
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        remove_duplicates(table, columns)
+
+    if op.get_context().dialect.name != 'postgresql':
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+        for name, table, columns in UNIQUE_CONSTRAINTS:
+            with op.batch_alter_table(table) as batch_op:
+                batch_op.create_unique_constraint(name, columns)
+        return
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES + UNIQUE_CONSTRAINTS:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=(name, table, columns) in UNIQUE_CONSTRAINTS,
+                postgresql_concurrently=True,
+            )
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        op.execute(
+            f'ALTER TABLE "{table}" ADD CONSTRAINT {name} UNIQUE USING INDEX {name}'
+        )
+
+
+def downgrade() -> None:
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint(name, type_='unique')
+    for name, table, columns in INDEXES:
+        op.drop_index(name, table_name=table)
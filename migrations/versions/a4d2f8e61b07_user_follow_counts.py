@@ -0,0 +1,29 @@
+"""user follow counts
+
+Revision ID: a4d2f8e61b07
+Revises: f1a9c3d47e25
+Create Date: 2026-10-18 16:52:19.503361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d2f8e61b07'
+down_revision = 'f1a9c3d47e25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows start at 0, run `pamps backfill-counts` afterwards
+    op.add_column('user', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
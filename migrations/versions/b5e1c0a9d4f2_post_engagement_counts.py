@@ -0,0 +1,29 @@
+"""post engagement counts
+
+Revision ID: b5e1c0a9d4f2
+Revises: 8f3b2d1c6a7e
+Create Date: 2026-10-18 12:41:36.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e1c0a9d4f2'
+down_revision = '8f3b2d1c6a7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows start at 0, run `pamps backfill-counts` afterwards
+    op.add_column('post', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('post', sa.Column('reply_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('reply_count')
+        batch_op.drop_column('like_count')
@@ -0,0 +1,60 @@
+"""username prefix
+
+Revision ID: c6f2a9d13e58
+Revises: a4d2f8e61b07
+Create Date: 2026-10-18 17:34:08.912457
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f2a9d13e58'
+down_revision = 'a4d2f8e61b07'
+branch_labels = None
+depends_on = None
+
+# The typeahead matches prefixes against username_key, the username
+# lowercased in Python (pamps.models.user.username_key): SQLite's lower()
+# only folds ASCII. The indexes are the ones of USERNAME_PREFIX_DDL in
+# pamps/models/user.py. On Postgres the index is built CONCURRENTLY, outside
+# the migration transaction, so writes to "user" go on during the build.
+
+
+def upgrade() -> None:
+    op.add_column('user', sa.Column('username_key', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+    user = sa.table(
+        'user',
+        sa.column('id', sa.Integer),
+        sa.column('username', sa.String),
+        sa.column('username_key', sa.String),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(user.c.id, user.c.username)).all()
+    if rows:
+        connection.execute(
+            user.update()
+            .where(user.c.id == sa.bindparam('user_id'))
+            .values(username_key=sa.bindparam('key')),
+            [{'user_id': id, 'key': username.lower()} for id, username in rows],
+        )
+
+    if op.get_context().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_user_username_prefix',
+                'user',
+                [sa.text('(username_key COLLATE "C")')],
+                postgresql_concurrently=True,
+            )
+    else:
+        op.create_index('ix_user_username_prefix', 'user', ['username_key'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_username_prefix', table_name='user')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('username_key')
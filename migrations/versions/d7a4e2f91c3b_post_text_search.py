@@ -0,0 +1,60 @@
+"""post text search
+
+Revision ID: d7a4e2f91c3b
+Revises: b5e1c0a9d4f2
+Create Date: 2026-10-18 14:22:53.610935
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a4e2f91c3b'
+down_revision = 'b5e1c0a9d4f2'
+branch_labels = None
+depends_on = None
+
+# Same objects as `POST_SEARCH_DDL` in pamps/models/post.py
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER post_fts_update AFTER UPDATE OF text ON post BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO post_fts (rowid, text) VALUES (new.id, new.text); END",
+]
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY can not run inside a transaction
+        with op.get_context().autocommit_block():
+            op.execute(
+                'CREATE INDEX CONCURRENTLY ix_post_text_search ON post '
+                "USING gin (to_tsvector('english', text))"
+            )
+        return
+
+    op.execute(
+        'CREATE VIRTUAL TABLE post_fts USING fts5('
+        "text, content='post', content_rowid='id')"
+    )
+    # index the existing posts
+    op.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+    for trigger in SQLITE_TRIGGERS:
+        op.execute(trigger)
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_index('ix_post_text_search', table_name='post')
+        return
+
+    for name in ('post_fts_insert', 'post_fts_delete', 'post_fts_update'):
+        op.execute(f'DROP TRIGGER {name}')
+    op.execute('DROP TABLE post_fts')
@@ -0,0 +1,47 @@
+"""hashtag and mention
+
+Revision ID: e3c8b6a25d10
+Revises: d7a4e2f91c3b
+Create Date: 2026-10-18 15:03:27.845119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3c8b6a25d10'
+down_revision = 'd7a4e2f91c3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing posts are not indexed, run `pamps backfill-tags` afterwards
+    op.create_table('hashtag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tag', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('post_id', 'tag', name='uq_hashtag_post_id_tag')
+    )
+    op.create_index('ix_hashtag_tag_post_id', 'hashtag', ['tag', 'post_id'], unique=False)
+    op.create_table('mention',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('post_id', 'user_id', name='uq_mention_post_id_user_id')
+    )
+    op.create_index('ix_mention_user_id_post_id', 'mention', ['user_id', 'post_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_mention_user_id_post_id', table_name='mention')
+    op.drop_table('mention')
+    op.drop_index('ix_hashtag_tag_post_id', table_name='hashtag')
+    op.drop_table('hashtag')
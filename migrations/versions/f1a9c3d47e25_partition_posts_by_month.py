@@ -0,0 +1,128 @@
+"""partition posts by month
+
+Revision ID: f1a9c3d47e25
+Revises: e3c8b6a25d10
+Create Date: 2026-10-18 16:10:42.377204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3d47e25'
+down_revision = 'e3c8b6a25d10'
+branch_labels = None
+depends_on = None
+
+# Postgres only. A unique key of a partitioned table must include the
+# partition key, so post.id alone can not be referenced any more: the
+# foreign keys of like, hashtag, mention and post.parent_id to post.id are
+# dropped and the primary key becomes (id, date). Ids still come from
+# post_id_seq.
+#
+# Nothing replaces those foreign keys in the database. The API checks the
+# post exists before it writes a reply (parent_id) or a like, and writes
+# hashtags and mentions with their post. Rows written outside the API are
+# not checked, and archiving a partition leaves the replies, likes,
+# hashtags and mentions of its posts pointing at posts no longer in `post`.
+#
+# Maintenance window: upgrade copies the whole post table into the
+# partitioned one in a single transaction, holding a lock on post until it
+# commits. Stop the API and the workers writing posts, likes and replies
+# before running it; on large tables expect it to take as long as a full
+# table rewrite plus the index builds.
+
+INDEXES = [
+    ('ix_post_user_id_date_id', '(user_id, date, id)'),
+    ('ix_post_parent_id_date_id', '(parent_id, date, id)'),
+    ('ix_post_text_search', "USING gin (to_tsvector('english', text))"),
+]
+
+REFERENCES = [
+    ('like', 'post_id'),
+    ('hashtag', 'post_id'),
+    ('mention', 'post_id'),
+    ('post', 'parent_id'),
+]
+
+DROP_FOREIGN_KEYS_TO_POST = """
+DO $$
+DECLARE r record;
+BEGIN
+    FOR r IN SELECT conrelid::regclass AS tbl, conname FROM pg_constraint
+             WHERE contype = 'f' AND confrelid = 'post'::regclass LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', r.tbl, r.conname);
+    END LOOP;
+END $$
+"""
+
+# From the month of the oldest post to 3 months ahead, later months are
+# created by `pamps create-partitions`, see pamps/partitions.py
+CREATE_MONTHLY_PARTITIONS = """
+DO $$
+DECLARE month date;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', coalesce((SELECT min(date) FROM post_unpartitioned), now())),
+        date_trunc('month', now()) + interval '3 months',
+        interval '1 month'
+    )::date LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF post FOR VALUES FROM (%L) TO (%L)',
+            'post_' || to_char(month, '"y"YYYY"m"MM'),
+            month,
+            (month + interval '1 month')::date
+        );
+    END LOOP;
+END $$
+"""
+
+
+def create_indexes() -> None:
+    for name, definition in INDEXES:
+        op.execute(f'CREATE INDEX {name} ON post {definition}')
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    op.execute(DROP_FOREIGN_KEYS_TO_POST)
+    op.execute('ALTER TABLE post RENAME TO post_unpartitioned')
+    op.execute('ALTER INDEX post_pkey RENAME TO post_unpartitioned_pkey')
+    op.execute('ALTER SEQUENCE post_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE post (LIKE post_unpartitioned INCLUDING DEFAULTS) '
+        'PARTITION BY RANGE (date)'
+    )
+    op.execute('ALTER TABLE post ADD PRIMARY KEY (id, date)')
+    op.execute('ALTER TABLE post ADD FOREIGN KEY (user_id) REFERENCES "user" (id)')
+    op.execute(CREATE_MONTHLY_PARTITIONS)
+    op.execute('CREATE TABLE post_default PARTITION OF post DEFAULT')
+    op.execute('INSERT INTO post SELECT * FROM post_unpartitioned')
+    op.execute('DROP TABLE post_unpartitioned')
+    op.execute('ALTER SEQUENCE post_id_seq OWNED BY post.id')
+    create_indexes()
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        return
+
+    # Partitions detached by `pamps archive-partitions` are not copied back
+    op.execute('ALTER TABLE post RENAME TO post_partitioned')
+    op.execute('ALTER INDEX post_pkey RENAME TO post_partitioned_pkey')
+    op.execute('ALTER SEQUENCE post_id_seq OWNED BY NONE')
+    op.execute('CREATE TABLE post (LIKE post_partitioned INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO post SELECT * FROM post_partitioned')
+    op.execute('DROP TABLE post_partitioned')
+    op.execute('ALTER SEQUENCE post_id_seq OWNED BY post.id')
+    op.execute('ALTER TABLE post ADD PRIMARY KEY (id)')
+    op.execute('ALTER TABLE post ADD FOREIGN KEY (user_id) REFERENCES "user" (id)')
+    create_indexes()
+    for table, column in REFERENCES:
+        op.execute(
+            f'ALTER TABLE "{table}" ADD FOREIGN KEY ({column}) REFERENCES post (id)'
+        )
@@ -1,6 +1,12 @@
 from fastapi import FastAPI
 
+from .broker import broker
+from .db import replica_set
+from .likes import like_buffer
+from .partitions import post_months_reloader
 from .routes import main_router
+from .security import hashing_pool
+from .trending import trending
 
 app = FastAPI(
     title="Pamps",
@@ -9,3 +15,58 @@ app = FastAPI(
 )
 
 app.include_router(main_router)
+
+
+@app.on_event("startup")
+async def start_broker():
+    await broker.start()
+
+
+@app.on_event("shutdown")
+async def stop_broker():
+    await broker.stop()
+
+
+@app.on_event("startup")
+def start_replica_probe():
+    replica_set.start()
+
+
+@app.on_event("shutdown")
+def stop_replica_probe():
+    replica_set.stop()
+
+
+@app.on_event("startup")
+def start_like_buffer():
+    like_buffer.start()
+
+
+@app.on_event("startup")
+def start_post_months_reloader():
+    post_months_reloader.start()
+
+
+@app.on_event("shutdown")
+def stop_post_months_reloader():
+    post_months_reloader.stop()
+
+
+@app.on_event("startup")
+def start_trending():
+    trending.start()
+
+
+@app.on_event("shutdown")
+def stop_trending():
+    trending.stop()
+
+
+@app.on_event("shutdown")
+async def flush_like_buffer():
+    await like_buffer.stop()
+
+
+@app.on_event("shutdown")
+def shutdown_hashing_pool():
+    hashing_pool.shutdown()
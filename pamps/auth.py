@@ -1,17 +1,20 @@
 """Token based auth"""
 from datetime import datetime, timedelta
-from typing import Callable, Optional, Union
+from typing import Callable, Dict, Iterable, Optional, Union
 
 from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlalchemy import event, inspect
+from sqlmodel import select
 
+from pamps import metrics
+from pamps.cache import TTLCache
 from pamps.config import settings
-from pamps.db import engine
+from pamps.db import async_session_factory
 from pamps.models.user import User
-from pamps.security import verify_password
+from pamps.security import async_verify_password
 
 SECRET_KEY = settings.security.secret_key
 ALGORITHM = settings.security.algorithm
@@ -19,6 +22,23 @@ ALGORITHM = settings.security.algorithm
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# username of every cached user by id, for the Core updates of the
+# counters which do not fire the ORM events below
+cached_usernames: Dict[int, str] = {}
+
+
+def _forget_cached_user(username: str, user: User) -> None:
+    if cached_usernames.get(user.id) == username:
+        del cached_usernames[user.id]
+
+
+user_cache = TTLCache(
+    max_size=settings.security.user_cache_max_size,
+    ttl=settings.security.user_cache_ttl_seconds,
+    on_evict=_forget_cached_user,
+)
+metrics.register("user_cache", user_cache.stats)
+
 
 class Token(BaseModel):
     access_token: str
@@ -58,26 +78,59 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None)
     return encoded_jwt
 
 
-def authenticate_user(
+async def authenticate_user(
     get_user: Callable, username: str, password: str
 ) -> Union[User, bool]:
     """Authenticate the user"""
-    user = get_user(username)
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await async_verify_password(password, user.password):
         return False
     return user
 
 
-def get_user(username) -> Optional[User]:
+async def get_user(username) -> Optional[User]:
     """Get user from database"""
     query = select(User).where(User.username == username)
-    with Session(engine) as session:
-        return session.exec(query).first()
+    async with async_session_factory() as session:
+        return (await session.exec(query)).first()
+
+
+async def get_cached_user(username: str, expires_at: Optional[float] = None):
+    """Get user from the request path cache, falling back to the database.
+
+    Entries never outlive `expires_at`, the `exp` claim of the token.
+    """
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_user(username)
+        if user is not None:
+            user_cache.set(username, user, expires_at=expires_at)
+            cached_usernames[user.id] = username
+    return user
+
+
+def invalidate_cached_users(user_ids: Iterable[int]) -> None:
+    """Drops users changed by id, e.g. by an UPDATE of their counters"""
+    for user_id in user_ids:
+        username = cached_usernames.pop(user_id, None)
+        if username is not None:
+            user_cache.invalidate(username)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User) -> None:
+    """Drops a changed user from the cache, including a renamed username"""
+    usernames = {target.username}
+    usernames.update(inspect(target).attrs.username.history.deleted or ())
+    for username in usernames:
+        user_cache.invalidate(username)
+    cached_usernames.pop(target.id, None)
 
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme), request: Request = None, fresh=False
 ) -> User:
     """Get current user authenticated"""
@@ -103,7 +156,7 @@ def get_current_user(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    user = await get_cached_user(token_data.username, expires_at=payload.get("exp"))
     if user is None:
         raise credentials_exception
     if fresh and (not payload["fresh"] and not user.superuser):
@@ -124,5 +177,5 @@ AuthenticatedUser = Depends(get_current_active_user)
 
 async def validate_token(token: str = Depends(oauth2_scheme)) -> User:
     """Validates user token"""
-    user = get_current_user(token=token)
+    user = await get_current_user(token=token)
     return user
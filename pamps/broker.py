@@ -0,0 +1,225 @@
+"""In-process pub/sub for live post streams.
+
+`create_post` publishes every new post to `user:{author_id}` and, for a
+reply, to `thread:{parent_id}`. Stream endpoints subscribe to the topics
+they follow and get messages on a bounded queue; a subscriber whose queue
+fills up is dropped instead of slowing down the publisher.
+
+The backend carries messages between processes: "memory" only delivers in
+the current process, "redis" goes through Redis pub/sub so every worker
+sees every post.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set
+
+from pamps import metrics
+from pamps.config import settings
+from pamps.models.post import PostResponse
+from pamps.serialization import dumps
+
+log = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Queue of messages for the topics of one stream client.
+
+    `get` returns None once the subscription was dropped or closed.
+    """
+
+    def __init__(self, broker: "Broker", topics: Iterable[str], queue_size: int):
+        self.broker = broker
+        self.topics: Set[str] = set(topics)
+        self.closed = False
+        self.loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    async def get(self) -> Optional[bytes]:
+        if self.closed and self._queue.empty():
+            return None
+        return await self._queue.get()
+
+    def offer(self, message: bytes) -> None:
+        """Queues a message, must run on the loop of the subscriber"""
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.broker.dropped += 1
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.broker.unsubscribe(self)
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)  # wakes up a pending `get`
+
+
+class MemoryBackend:
+    """Delivers to the subscribers of the current process only"""
+
+    def __init__(self):
+        self.broker: Optional["Broker"] = None
+
+    async def publish(self, topic: str, message: bytes) -> None:
+        self.broker.deliver(topic, message)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RedisBackend:
+    """Fans messages out to every process through Redis pub/sub.
+
+    `client` is a `redis.asyncio.Redis` compatible object, one is created
+    from `url` when it is not given.
+    """
+
+    def __init__(self, client=None, url: str = "", prefix: str = "pamps:stream"):
+        if client is None:
+            try:
+                from redis.asyncio import Redis
+            except ImportError:  # pragma: no cover
+                raise RuntimeError("The redis stream backend requires `redis`")
+            client = Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.broker: Optional["Broker"] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, topic: str, message: bytes) -> None:
+        await self.client.publish(f"{self.prefix}:{topic}", message)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def listen(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except Exception:
+                log.exception("Lost the redis stream subscription, retrying")
+                await asyncio.sleep(1)
+
+    async def _listen(self) -> None:
+        pubsub = self.client.pubsub()
+        await pubsub.psubscribe(f"{self.prefix}:*")
+        skip = len(self.prefix) + 1
+        async for event in pubsub.listen():
+            if event["type"] != "pmessage":
+                continue
+            channel = event["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self.broker.deliver(channel[skip:], event["data"])
+
+
+class Broker:
+    def __init__(self, backend=None, queue_size: int = 100):
+        self.backend = backend or MemoryBackend()
+        self.backend.broker = self
+        self.queue_size = queue_size
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._topics: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def stop(self) -> None:
+        await self.backend.stop()
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """Subscribes the running event loop to `topics`"""
+        subscription = Subscription(self, topics, self.queue_size)
+        self.add_topics(subscription, subscription.topics)
+        return subscription
+
+    def add_topics(self, subscription: Subscription, topics: Iterable[str]) -> None:
+        with self._lock:
+            for topic in topics:
+                subscription.topics.add(topic)
+                self._topics[topic].add(subscription)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    async def publish(self, topic: str, message: bytes) -> None:
+        self.published += 1
+        await self.backend.publish(topic, message)
+
+    def deliver(self, topic: str, message: bytes) -> None:
+        """Hands a message to the local subscribers of `topic`, on their
+        own event loops when called from another thread or loop"""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for subscription in subscribers:
+            if subscription.loop is current:
+                subscription.offer(message)
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # the loop of the subscriber is closed, nobody reads it anymore
+                subscription.closed = True
+                self.unsubscribe(subscription)
+                self.dropped += 1
+        self.delivered += len(subscribers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscriptions = set().union(*self._topics.values())
+        return {
+            "subscribers": len(subscriptions),
+            "topics": len(self._topics),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+def make_backend():
+    config = settings.stream
+    if config.backend == "redis":
+        return RedisBackend(url=config.redis_url)
+    return MemoryBackend()
+
+
+broker = Broker(make_backend(), queue_size=settings.stream.queue_size)
+metrics.register("stream_broker", broker.stats)
+
+
+async def publish_post(post: dict) -> None:
+    """Publishes the PostResponse document of a new post to its author's
+    topic and its parent's thread"""
+    message = dumps(PostResponse.parse_obj(post).dict())
+    await broker.publish(f"user:{post['user_id']}", message)
+    if post["parent_id"] is not None:
+        await broker.publish(f"thread:{post['parent_id']}", message)
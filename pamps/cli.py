@@ -1,12 +1,18 @@
+from datetime import date
+
 import typer
 import uvicorn
 from rich.console import Console
 from rich.table import Table
+from sqlalchemy import func, update
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, select
 
+from . import partitions
 from .config import settings
 from .db import engine
-from .models import Post, Social, SQLModel, User
+from .models import Like, Post, Social, SQLModel, User
+from .tags import index_posts
 
 cli = typer.Typer(name="Pamps CLI")
 
@@ -97,6 +103,92 @@ def create_user(email: str, username: str, password: str, user_id=None):
         return user
 
 
+@cli.command()
+def backfill_counts(batch_size: int = 1000):
+    """Recomputes the post and user counters in batches.
+
+    Running API workers keep the users and responses they cached with the
+    old counters until their TTL, `security.user_cache_ttl_seconds` and
+    `response_cache.ttl`.
+    """
+    reply = aliased(Post)
+    like_count = (
+        select(func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+    )
+    reply_count = (
+        select(func.count(reply.id)).where(reply.parent_id == Post.id).scalar_subquery()
+    )
+    with Session(engine) as session:
+        max_id = session.exec(select(func.max(Post.id))).one() or 0
+        for start in range(0, max_id, batch_size):
+            session.execute(
+                update(Post)
+                .where(Post.id > start, Post.id <= start + batch_size)
+                .values(like_count=like_count, reply_count=reply_count)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            typer.echo(f"backfilled posts up to id {min(start + batch_size, max_id)}")
+
+    follower_count = (
+        select(func.count(Social.id)).where(Social.to_id == User.id).scalar_subquery()
+    )
+    following_count = (
+        select(func.count(Social.id)).where(Social.from_id == User.id).scalar_subquery()
+    )
+    with Session(engine) as session:
+        max_id = session.exec(select(func.max(User.id))).one() or 0
+        for start in range(0, max_id, batch_size):
+            session.execute(
+                update(User)
+                .where(User.id > start, User.id <= start + batch_size)
+                .values(follower_count=follower_count, following_count=following_count)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            typer.echo(f"backfilled users up to id {min(start + batch_size, max_id)}")
+
+
+@cli.command()
+def backfill_tags(batch_size: int = 1000):
+    """Indexes the hashtags and mentions of every post in batches"""
+    with Session(engine) as session:
+        max_id = session.exec(select(func.max(Post.id))).one() or 0
+        for start in range(0, max_id, batch_size):
+            query = select(Post).where(Post.id > start, Post.id <= start + batch_size)
+            index_posts(session, session.exec(query).all())
+            session.commit()
+            typer.echo(f"indexed posts up to id {min(start + batch_size, max_id)}")
+
+
+@cli.command()
+def create_partitions(months_ahead: int = settings.partitions.months_ahead):
+    """Creates the monthly post partitions up to `months_ahead` months"""
+    with engine.begin() as connection:
+        if not partitions.is_partitioned(connection):
+            typer.echo("post is not partitioned")
+            raise typer.Exit(1)
+        for name in partitions.create_partitions(connection, months_ahead):
+            typer.echo(f"created {name}")
+
+
+@cli.command()
+def archive_partitions(
+    months: int = typer.Option(
+        settings.partitions.archive_after_months,
+        help="Detach the partitions of months older than this many months",
+    )
+):
+    """Detaches old monthly post partitions"""
+    year, month = partitions.add_months(partitions.month_of(date.today()), -months)
+    with engine.begin() as connection:
+        if not partitions.is_partitioned(connection):
+            typer.echo("post is not partitioned")
+            raise typer.Exit(1)
+        for name in partitions.archive_partitions(connection, date(year, month, 1)):
+            typer.echo(f"detached {name}")
+
+
 @cli.command()
 def reset_db(
     force: bool = typer.Option(False, "--force", "-f", help="Run with no confirmation")
@@ -1,16 +1,320 @@
 """Database connection"""
-from fastapi import Depends
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Type
+
+from fastapi import Depends, Request
+from jose import JWTError, jwt
+from sqlalchemy import event, exc, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import Pool
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from . import metrics
+from .cache import TTLCache
 from .config import settings
 
-engine = create_engine(
-    settings.db.uri,
-    echo=settings.db.echo,
-    connect_args=settings.db.connect_args,
+log = logging.getLogger(__name__)
+
+POOL_OPTIONS = ("pool_pre_ping", "pool_recycle")
+POOL_SIZE_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+def default_pool_class(uri) -> Type[Pool]:
+    url = make_url(uri)
+    return url.get_dialect().get_pool_class(url)
+
+
+def get_pool_options(uri) -> dict:
+    """Pool arguments from `settings.db` that apply to the dialect of `uri`.
+
+    SQLite runs without a sized pool so the sizing options are left out.
+    """
+    names = POOL_OPTIONS
+    if make_url(uri).get_backend_name() != "sqlite":
+        names += POOL_SIZE_OPTIONS
+    return {name: settings.db[name] for name in names if name in settings.db}
+
+
+class PoolMetrics:
+    """Collects connection pool counters from SQLAlchemy pool events.
+
+    Pool events fire once a connection is handed out, so the time spent
+    waiting for one and the checkout timeouts are measured by the pool
+    class from `pool_class`, which `Pool.recreate` keeps when the engine
+    is disposed. Listeners registered on the engine are kept as well.
+    """
+
+    def __init__(self):
+        self.engine: Optional[Engine] = None
+        self.checked_out = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def pool_class(self, base: Type[Pool]) -> Type[Pool]:
+        """`base` timing how long checkouts wait for a connection"""
+        pool_metrics = self
+
+        def _do_get(pool):
+            start = time.perf_counter()
+            try:
+                return base._do_get(pool)
+            except exc.TimeoutError:
+                with pool_metrics._lock:
+                    pool_metrics.timeouts += 1
+                raise
+            finally:
+                pool_metrics._on_wait(time.perf_counter() - start)
+
+        return type(base.__name__, (base,), {"_do_get": _do_get})
+
+    def instrument(self, engine: Engine) -> None:
+        self.engine = engine
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_wait(self, waited: float) -> None:
+        with self._lock:
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "checked_out": self.checked_out,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "invalidated": self.invalidated,
+            "timeouts": self.timeouts,
+            "wait_time": round(self.wait_time, 6),
+            "max_wait_time": round(self.max_wait_time, 6),
+        }
+
+
+class ReplicaSet:
+    """Round robin over the read replicas that are currently healthy.
+
+    A replica that fails to hand out a connection is marked down and
+    skipped for `retry_after` seconds. While running, a background probe
+    checks every replica each `probe_interval` seconds, marking down the
+    failing ones and re-admitting the ones that recovered.
+    """
+
+    def __init__(
+        self,
+        engines: List[AsyncEngine],
+        retry_after: float = 30.0,
+        probe_interval: float = 5.0,
+        probe_timeout: float = 2.0,
+    ):
+        self.engines = engines
+        self.retry_after = retry_after
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failures = 0
+        self.probes = 0
+        self._down_until = [0.0] * len(engines)
+        self._counter = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+        for replica in engines:
+            if isinstance(replica, AsyncEngine):
+                event.listen(
+                    replica.sync_engine, "handle_error", self._on_error(replica)
+                )
+
+    def _on_error(self, replica: AsyncEngine):
+        def on_error(context) -> None:
+            # no connection: the replica could not hand one out
+            if context.connection is None or context.is_disconnect:
+                self.mark_down(replica)
+
+        return on_error
+
+    def healthy(self) -> List[AsyncEngine]:
+        """Healthy replicas, starting at the next one in the rotation"""
+        if not self.engines:
+            return []
+        now = time.monotonic()
+        start = next(self._counter)
+        indexes = [(start + n) % len(self.engines) for n in range(len(self.engines))]
+        return [self.engines[i] for i in indexes if self._down_until[i] <= now]
+
+    def mark_down(self, engine: AsyncEngine) -> None:
+        self.failures += 1
+        index = self.engines.index(engine)
+        self._down_until[index] = time.monotonic() + self.retry_after
+
+    def mark_up(self, engine: AsyncEngine) -> None:
+        self._down_until[self.engines.index(engine)] = 0.0
+
+    async def probe(self) -> None:
+        """Runs `SELECT 1` on every replica"""
+        self.probes += 1
+        for replica in self.engines:
+            try:
+                async with replica.connect() as connection:
+                    await asyncio.wait_for(
+                        connection.execute(text("SELECT 1")), self.probe_timeout
+                    )
+            except (exc.DBAPIError, OSError, asyncio.TimeoutError):
+                # connect failures are marked down by `_on_error` already
+                if self._down_until[self.engines.index(replica)] <= time.monotonic():
+                    self.mark_down(replica)
+            else:
+                self.mark_up(replica)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.probe()
+            except Exception:
+                log.exception("Failed to probe the read replicas")
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self) -> None:
+        if self.engines and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "replicas": len(self.engines),
+            "healthy": sum(until <= now for until in self._down_until),
+            "failures": self.failures,
+            "probes": self.probes,
+        }
+
+
+def get_request_subject(request: Request) -> Optional[str]:
+    """Token subject of the request, used only to route it.
+
+    The signature is not verified here, authentication happens in
+    `pamps.auth`; a forged subject can at most pin reads to the primary.
+    """
+    authorization = request.headers.get("authorization", "")
+    _, _, token = authorization.partition(" ")
+    if not token:
+        return None
+    try:
+        return jwt.get_unverified_claims(token).get("sub")
+    except JWTError:
+        return None
+
+
+def create_instrumented_engine(create: Callable, uri, name: str):
+    """Engine of `uri` made by `create`, with its pool counters registered
+    under `name`"""
+    pool_metrics = PoolMetrics()
+    engine = create(
+        uri,
+        echo=settings.db.echo,
+        connect_args=settings.db.connect_args,
+        poolclass=pool_metrics.pool_class(default_pool_class(uri)),
+        **get_pool_options(uri),
+    )
+    pool_metrics.instrument(getattr(engine, "sync_engine", engine))
+    metrics.register(name, pool_metrics.stats)
+    return engine, pool_metrics
+
+
+engine, pool_metrics = create_instrumented_engine(
+    create_engine, settings.db.uri, "db_pool"
 )
 
 
+def get_async_url(uri: str) -> URL:
+    """Swaps the driver of a sync database uri for its async counterpart
+    as configured in `settings.db.async_drivers`"""
+    url = make_url(uri)
+    driver = settings.db.async_drivers[url.get_backend_name()]
+    return url.set(drivername=driver)
+
+
+async_url = settings.db.get("async_uri") or get_async_url(settings.db.uri)
+async_engine, async_pool_metrics = create_instrumented_engine(
+    create_async_engine, async_url, "db_async_pool"
+)
+
+replica_set = ReplicaSet(
+    [
+        create_instrumented_engine(
+            create_async_engine, get_async_url(uri), f"db_replica_{n}_pool"
+        )[0]
+        for n, uri in enumerate(settings.db.replicas)
+    ],
+    retry_after=settings.db.replica_retry_seconds,
+    probe_interval=settings.db.replica_probe_seconds,
+)
+metrics.register("db_replicas", replica_set.stats)
+
+# Subjects that wrote recently and must read from the primary for a while
+write_pins = TTLCache(max_size=100_000, ttl=settings.db.read_your_writes_seconds)
+
+async_session_factory = sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+
+def pin_to_primary(subject: Optional[str]) -> None:
+    """Sends the reads of `subject` to the primary for the read-your-writes
+    window"""
+    if subject and write_pins.ttl > 0:
+        write_pins.set(subject, True)
+
+
+@event.listens_for(Session, "after_commit")
+def _pin_writer_to_primary(session: Session) -> None:
+    pin_to_primary(session.info.get("subject"))
+
+
+INSERT_BY_DIALECT = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def insert_or_ignore(session, model):
+    """INSERT ... ON CONFLICT DO NOTHING for the dialect of `session`"""
+    insert = INSERT_BY_DIALECT[session.bind.dialect.name]
+    return insert(model.__table__).on_conflict_do_nothing()
+
+
 def create_db_and_tables(engine):
     SQLModel.metadata.create_all(engine)
 
@@ -20,4 +324,30 @@ def get_session():
         yield session
 
 
+async def get_async_session(request: Request):
+    async with async_session_factory() as session:
+        session.info["subject"] = get_request_subject(request)
+        yield session
+
+
+async def get_async_read_session(request: Request):
+    """Session bound to a healthy read replica, or to the primary when
+    there is none or the requester wrote within the read-your-writes window.
+
+    The session connects on its first query, routes that answer from a
+    cache never check a connection out. `request.state.read_replica` tells
+    the response cache the rows may lag behind the primary.
+    """
+    subject = get_request_subject(request)
+    replicas = []
+    if not (subject and write_pins.get(subject)):
+        replicas = replica_set.healthy()
+    bind = replicas[0] if replicas else async_engine
+    request.state.read_replica = bool(replicas)
+    async with async_session_factory(bind=bind) as session:
+        yield session
+
+
 ActiveSession = Depends(get_session)
+AsyncActiveSession = Depends(get_async_session)
+AsyncReadSession = Depends(get_async_read_session)
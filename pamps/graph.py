@@ -0,0 +1,309 @@
+"""In-memory social graph.
+
+`Social(from_id, to_id)` is loaded into compressed sparse row (CSR)
+adjacency arrays, one for who each user follows and one for their
+followers: the neighbours of user `u` are `targets[offsets[u]:offsets[u + 1]]`,
+sorted. Follows and unfollows made since the last build are kept in small
+per-user sets and merged into new arrays once there are `compact_after` of
+them.
+
+Two-hop counting runs a `collections.Counter` over the CSR slices of the
+followees instead of a vectorized count: numpy is not a dependency of the
+project, and the work is bounded by the second-degree neighbourhood of one
+user, not by the size of the graph.
+
+Builds run in the default executor and the new arrays are swapped in at
+once; changes made while a build runs are replayed onto its result. Loads
+and compactions take the same lock, so only one build records changes at
+a time.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps import metrics
+from pamps.config import settings
+from pamps.db import async_session_factory
+from pamps.models.user import Social
+
+log = logging.getLogger(__name__)
+
+Edge = Tuple[int, int]  # (from_id, to_id)
+
+
+class Adjacency:
+    """CSR adjacency of one direction plus the changes since it was built"""
+
+    def __init__(self, edges: Iterable[Edge] = ()):
+        edges = sorted(set(edges))
+        size = (max(source for source, _ in edges) + 2) if edges else 1
+        counts = array("q", bytes(8 * size))
+        for source, _ in edges:
+            counts[source + 1] += 1
+        self.offsets = array("q", itertools.accumulate(counts))
+        self.targets = array("q", (target for _, target in edges))
+        self.added: Dict[int, Set[int]] = defaultdict(set)
+        self.removed: Dict[int, Set[int]] = defaultdict(set)
+        self.changes = 0
+
+    def _base(self, source: int) -> Sequence[int]:
+        if source + 1 >= len(self.offsets):
+            return ()
+        return self.targets[self.offsets[source] : self.offsets[source + 1]]
+
+    def neighbours(self, source: int) -> List[int]:
+        base = self._base(source)
+        if source not in self.added and source not in self.removed:
+            return list(base)
+        removed = self.removed.get(source, ())
+        merged = {target for target in base if target not in removed}
+        return sorted(merged | self.added.get(source, set()))
+
+    def has(self, source: int, target: int) -> bool:
+        if target in self.added.get(source, ()):
+            return True
+        if target in self.removed.get(source, ()):
+            return False
+        base = self._base(source)
+        index = bisect.bisect_left(base, target)
+        return index < len(base) and base[index] == target
+
+    def add(self, source: int, target: int) -> None:
+        if self.has(source, target):
+            return
+        if target in self.removed.get(source, ()):
+            self.removed[source].discard(target)
+        else:
+            self.added[source].add(target)
+        self.changes += 1
+
+    def remove(self, source: int, target: int) -> None:
+        if not self.has(source, target):
+            return
+        if target in self.added.get(source, ()):
+            self.added[source].discard(target)
+        else:
+            self.removed[source].add(target)
+        self.changes += 1
+
+    def copy(self) -> "Adjacency":
+        """Adjacency sharing the CSR arrays, which are never modified, with
+        a copy of the changes"""
+        other = Adjacency()
+        other.offsets, other.targets = self.offsets, self.targets
+        for source, targets in self.added.items():
+            other.added[source] = set(targets)
+        for source, targets in self.removed.items():
+            other.removed[source] = set(targets)
+        other.changes = self.changes
+        return other
+
+    def edges(self) -> Iterable[Edge]:
+        sources = set(self.added) | set(self.removed)
+        for source in range(len(self.offsets) - 1):
+            if source not in sources:
+                for target in self._base(source):
+                    yield source, target
+        for source in sources:
+            for target in self.neighbours(source):
+                yield source, target
+
+    def __len__(self) -> int:
+        return (
+            len(self.targets)
+            + sum(map(len, self.added.values()))
+            - sum(map(len, self.removed.values()))
+        )
+
+
+class SocialGraph:
+    """Follow graph answering suggestion and mutual follow queries.
+
+    The graph is loaded from the database on first use and reloaded in
+    the background once it is older than `reload_interval` seconds, so
+    follows made by other processes show up eventually; follows made by
+    this process are applied right away.
+    """
+
+    def __init__(self, compact_after: int = 10000, reload_interval: float = 300):
+        self.compact_after = compact_after
+        self.reload_interval = reload_interval
+        self.loads = 0
+        self.compactions = 0
+        self.loaded_at: Optional[float] = None
+        self.following = Adjacency()
+        self.followers = Adjacency()
+        self._lock = threading.Lock()
+        self._load_lock: Optional[asyncio.Lock] = None
+        # held by the build that owns the journal, a load or a compaction
+        self._build_lock: Optional[asyncio.Lock] = None
+        # (followed, from_id, to_id) made while a build runs, None otherwise
+        self._journal: Optional[List[Tuple[bool, int, int]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def build(self, edges: Iterable[Edge]) -> None:
+        """Builds the arrays of `edges`, then swaps them in with the changes
+        recorded since the build started"""
+        edges = list(edges)
+        following = Adjacency(edges)
+        followers = Adjacency((target, source) for source, target in edges)
+        with self._lock:
+            for followed, from_id, to_id in self._journal or ():
+                if followed:
+                    following.add(from_id, to_id)
+                    followers.add(to_id, from_id)
+                else:
+                    following.remove(from_id, to_id)
+                    followers.remove(to_id, from_id)
+            self._journal = None
+            self.following, self.followers = following, followers
+
+    async def _build_in_executor(self, edges: Iterable[Edge]) -> None:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.build, edges)
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+
+    def _get_build_lock(self) -> asyncio.Lock:
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        return self._build_lock
+
+    async def load(self, session: AsyncSession) -> None:
+        query = select(Social.from_id, Social.to_id)
+        async with self._get_build_lock():
+            with self._lock:
+                self._journal = []
+            try:
+                edges = [tuple(row) for row in (await session.execute(query)).all()]
+            except BaseException:
+                with self._lock:
+                    self._journal = None
+                raise
+            await self._build_in_executor(edges)
+        self.loaded_at = time.monotonic()
+        self.loads += 1
+
+    async def ensure_loaded(self, session: AsyncSession) -> None:
+        """Loads the graph on first use, a stale one keeps answering while
+        it is reloaded in the background"""
+        if self.loaded_at is None:
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                if self.loaded_at is None:
+                    await self.load(session)
+        elif time.monotonic() - self.loaded_at >= self.reload_interval:
+            self._start(self._reload())
+
+    async def _reload(self) -> None:
+        async with async_session_factory() as session:
+            await self.load(session)
+
+    async def _compact(self) -> None:
+        async with self._get_build_lock():
+            if self.following.changes < self.compact_after:
+                return  # a load rebuilt the arrays meanwhile
+            # the copy shares the arrays, so the executor reads them while
+            # changes keep landing on the current adjacency
+            with self._lock:
+                self._journal = []
+                following = self.following.copy()
+            await self._build_in_executor(following.edges())
+        self.compactions += 1
+
+    def _start(self, coroutine) -> None:
+        """Runs one build at a time in the background"""
+        if self._task is not None:
+            coroutine.close()
+            return
+        self._task = asyncio.get_running_loop().create_task(coroutine)
+        self._task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._task = None
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Failed to build the social graph", exc_info=task.exception())
+
+    def follow(self, from_id: int, to_id: int) -> None:
+        with self._lock:
+            self.following.add(from_id, to_id)
+            self.followers.add(to_id, from_id)
+            if self._journal is not None:
+                self._journal.append((True, from_id, to_id))
+        self._compact_if_needed()
+
+    def unfollow(self, from_id: int, to_id: int) -> None:
+        with self._lock:
+            self.following.remove(from_id, to_id)
+            self.followers.remove(to_id, from_id)
+            if self._journal is not None:
+                self._journal.append((False, from_id, to_id))
+        self._compact_if_needed()
+
+    def _compact_if_needed(self) -> None:
+        if self.following.changes >= self.compact_after and self._task is None:
+            self._start(self._compact())
+
+    def is_following(self, from_id: int, to_id: int) -> bool:
+        return self.following.has(from_id, to_id)
+
+    def is_mutual(self, user_id: int, other_id: int) -> bool:
+        return self.is_following(user_id, other_id) and self.is_following(
+            other_id, user_id
+        )
+
+    def followed_by_followees(self, user_id: int, target_id: int) -> List[int]:
+        """Users followed by `user_id` who follow `target_id`"""
+        followees = set(self.following.neighbours(user_id))
+        return [
+            follower
+            for follower in self.followers.neighbours(target_id)
+            if follower in followees
+        ]
+
+    def suggestions(self, user_id: int, limit: int) -> List[Tuple[int, int]]:
+        """(user id, followees following them) of the users followed by the
+        users `user_id` follows, most shared first, without users already
+        followed"""
+        followees = self.following.neighbours(user_id)
+        if not followees:
+            return []
+        exclude = set(followees)
+        exclude.add(user_id)
+        counts = Counter(
+            itertools.chain.from_iterable(
+                self.following.neighbours(followee) for followee in followees
+            )
+        )
+        ranked = sorted(
+            (item for item in counts.items() if item[0] not in exclude),
+            key=lambda item: (-item[1], item[0]),
+        )
+        return ranked[:limit]
+
+    def stats(self) -> dict:
+        return {
+            "edges": len(self.following),
+            "pending_changes": self.following.changes,
+            "loads": self.loads,
+            "compactions": self.compactions,
+        }
+
+
+social_graph = SocialGraph(
+    compact_after=settings.graph.compact_after,
+    reload_interval=settings.graph.reload_seconds,
+)
+metrics.register("social_graph", social_graph.stats)
@@ -0,0 +1,248 @@
+"""Buffered like writes.
+
+Likes and unlikes are recorded in an in-process buffer keyed by
+(user_id, post_id), so repeated toggles of the same pair collapse into
+their final state. The buffer is written in batches when it reaches
+`max_pending` pairs or every `flush_interval` seconds. In "sync" mode
+every operation is written before the request returns.
+
+When a batch fails, its pairs are written one by one so a single bad pair
+does not hold back the others. A pair that keeps failing is dropped after
+`max_attempts` flushes.
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select, tuple_, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps import metrics
+from pamps.config import settings
+from pamps.db import async_session_factory, insert_or_ignore
+from pamps.models.post import Like, Post
+from pamps.partitions import update_posts
+from pamps.response_cache import response_cache
+
+log = logging.getLogger(__name__)
+
+Pair = Tuple[int, int]  # (user_id, post_id)
+
+
+async def existing_likes(session: AsyncSession, pairs: List[Pair]) -> Set[Pair]:
+    query = select(Like.user_id, Like.post_id).where(
+        tuple_(Like.user_id, Like.post_id).in_(pairs)
+    )
+    return {tuple(row) for row in (await session.execute(query)).all()}
+
+
+async def insert_likes(session: AsyncSession, pairs: List[Pair]) -> List[int]:
+    """Inserts the likes of `pairs`, returns the post id of every new one"""
+    rows = [{"user_id": user_id, "post_id": post_id} for user_id, post_id in pairs]
+    if session.bind.dialect.full_returning:
+        statement = insert_or_ignore(session, Like).values(rows)
+        result = await session.execute(statement.returning(Like.post_id))
+        return list(result.scalars())
+    # without RETURNING, SQLite: the transaction fails if another writer
+    # commits between this read and the insert
+    existing = await existing_likes(session, pairs)
+    await session.execute(insert_or_ignore(session, Like), rows)
+    return [post_id for user_id, post_id in pairs if (user_id, post_id) not in existing]
+
+
+async def delete_likes(session: AsyncSession, pairs: List[Pair]) -> List[int]:
+    """Deletes the likes of `pairs`, returns the post id of every deleted one"""
+    statement = (
+        delete(Like)
+        .where(tuple_(Like.user_id, Like.post_id).in_(pairs))
+        .execution_options(synchronize_session=False)
+    )
+    if session.bind.dialect.full_returning:
+        result = await session.execute(statement.returning(Like.post_id))
+        return list(result.scalars())
+    existing = await existing_likes(session, pairs)
+    await session.execute(statement)
+    return [post_id for _, post_id in existing]
+
+
+class LikeBuffer:
+    def __init__(
+        self,
+        mode: str = "buffered",
+        max_pending: int = 500,
+        flush_interval: float = 1,
+        max_attempts: int = 3,
+    ):
+        self.mode = mode
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.flushes = 0
+        self.flushed_pairs = 0
+        self.coalesced = 0
+        self.dropped = 0
+        # failed writes of the pairs waiting for another attempt
+        self._failures: Dict[Pair, int] = {}
+        self._pending: Dict[Pair, bool] = {}
+        # the batch being written, still the latest state of its pairs
+        self._in_flight: Dict[Pair, bool] = {}
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def state(self, user_id: int, post_id: int) -> Optional[bool]:
+        """Buffered state of a pair: True liked, False unliked, None unknown"""
+        pair = (user_id, post_id)
+        with self._lock:
+            if pair in self._pending:
+                return self._pending[pair]
+            return self._in_flight.get(pair)
+
+    async def like(self, user_id: int, post_id: int) -> bool:
+        """Records a like, returns True when it was written already"""
+        return await self._record((user_id, post_id), True)
+
+    async def unlike(self, user_id: int, post_id: int) -> bool:
+        """Records an unlike, returns True when it was written already"""
+        return await self._record((user_id, post_id), False)
+
+    async def _record(self, pair: Pair, liked: bool) -> bool:
+        with self._lock:
+            if pair in self._pending:
+                self.coalesced += 1
+            self._pending[pair] = liked
+            full = len(self._pending) >= self.max_pending
+        if self.mode == "sync" or full:
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self) -> None:
+        """Writes the buffered pairs in one transaction"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+            if not batch:
+                return
+            try:
+                try:
+                    await self._write(batch)
+                    for pair in batch.keys() & self._failures.keys():
+                        del self._failures[pair]
+                except Exception:
+                    if self.mode == "sync":
+                        raise  # fails the request that wrote it
+                    log.exception("Failed to write %d likes", len(batch))
+                    batch = await self._write_each(batch)
+            except asyncio.CancelledError:
+                # keeping newer operations recorded while the write ran
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+            self.flushes += 1
+            self.flushed_pairs += len(batch)
+        for post_id in {post_id for _, post_id in batch}:
+            await response_cache.invalidate(f"post:{post_id}")
+
+    async def _write_each(self, batch: Dict[Pair, bool]) -> Dict[Pair, bool]:
+        """Writes the pairs of a failed batch one by one, returns the written
+        ones. The others are buffered again, or dropped after `max_attempts`
+        failures."""
+        written = {}
+        for pair, liked in batch.items():
+            try:
+                await self._write({pair: liked})
+            except Exception:
+                failures = self._failures.pop(pair, 0) + 1
+                if failures >= self.max_attempts:
+                    self.dropped += 1
+                    log.error(
+                        "Dropping the %s of %s after %d failed writes",
+                        "like" if liked else "unlike",
+                        pair,
+                        failures,
+                    )
+                    continue
+                self._failures[pair] = failures
+                with self._lock:
+                    # a newer operation on the pair replaces this one
+                    self._pending.setdefault(pair, liked)
+            else:
+                self._failures.pop(pair, None)
+                written[pair] = liked
+        return written
+
+    async def _write(self, batch: Dict[Pair, bool]) -> None:
+        likes = [pair for pair, liked in batch.items() if liked]
+        unlikes = [pair for pair, liked in batch.items() if not liked]
+        async with async_session_factory() as session:
+            # like_count moves by the rows actually inserted and deleted
+            deltas: Counter = Counter()
+            if likes:
+                deltas.update(await insert_likes(session, likes))
+            if unlikes:
+                deltas.subtract(await delete_likes(session, unlikes))
+            by_delta = defaultdict(list)
+            for post_id, delta in deltas.items():
+                if delta:
+                    by_delta[delta].append(post_id)
+            for delta, post_ids in by_delta.items():
+                await update_posts(
+                    session,
+                    update(Post)
+                    .where(Post.id.in_(post_ids))
+                    .values(like_count=Post.like_count + delta)
+                    .execution_options(synchronize_session=False),
+                    post_ids,
+                )
+            await session.commit()
+
+    async def run(self) -> None:
+        """Flushes every `flush_interval` seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to flush %d likes", len(self._pending))
+
+    def start(self) -> None:
+        if self.mode != "sync" and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            # a batch cancelled mid-write is back in the buffer once it ends
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_pairs": self.flushed_pairs,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+like_buffer = LikeBuffer(
+    mode=settings.likes.mode,
+    max_pending=settings.likes.max_pending,
+    flush_interval=settings.likes.flush_interval,
+    max_attempts=settings.likes.max_attempts,
+)
+metrics.register("like_buffer", like_buffer.stats)
@@ -0,0 +1,175 @@
+"""Request scoped batched lookups.
+
+A `DataLoader` collects the keys asked with `load` during one event loop
+iteration and resolves all of them with a single `batch_load(keys)` call,
+caching the results for the rest of the request. `Loaders` holds one
+loader per entity on the session of a request, so embedding the author of
+every post in a response costs one `IN` query instead of one per post.
+"""
+import asyncio
+import functools
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+from fastapi import Depends
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps.db import AsyncReadSession
+from pamps.models.post import Post, PostAuthor, PostResponse
+from pamps.models.user import User
+from pamps.partitions import fetch_posts
+from pamps.serialization import column_fields, dumps, response_columns, row_dict
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+AUTHOR_COLUMNS = response_columns(PostAuthor, User)
+POST_COLUMNS = response_columns(PostResponse, Post)
+
+
+class DataLoader(Generic[K, V]):
+    """Batches and caches lookups by key.
+
+    `batch_load` returns a {key: value} dict, keys left out of it resolve
+    to None.
+    """
+
+    def __init__(self, batch_load: Callable[[List[K]], Awaitable[Dict[K, V]]]):
+        self.batch_load = batch_load
+        self.batches = 0
+        self._futures: Dict[K, asyncio.Future] = {}
+        self._queue: List[K] = []
+        # the loop keeps weak references to tasks only
+        self._tasks: Set[asyncio.Task] = set()
+
+    def load(self, key: K) -> "asyncio.Future[Optional[V]]":
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            if not self._queue:
+                loop.call_soon(self._start_dispatch)
+            self._queue.append(key)
+        return future
+
+    def _start_dispatch(self) -> None:
+        keys, self._queue = self._queue, []
+        futures = [self._futures[key] for key in keys]
+        task = asyncio.get_running_loop().create_task(self._dispatch(keys))
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._dispatched, keys, futures))
+
+    def _dispatched(
+        self, keys: List[K], futures: List[asyncio.Future], task: asyncio.Task
+    ) -> None:
+        """Fails the loads left pending by a batch that was cancelled, even
+        before it started, or interrupted by a BaseException"""
+        self._tasks.discard(task)
+        for key, future in zip(keys, futures):
+            if future.done():
+                continue
+            if self._futures.get(key) is future:
+                del self._futures[key]
+            if task.cancelled():
+                future.cancel()
+            else:
+                future.set_exception(task.exception())
+
+    async def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: K, value: V) -> None:
+        """Caches a value already known to the caller"""
+        if key not in self._futures:
+            future = self._futures[key] = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+
+    async def _dispatch(self, keys: List[K]) -> None:
+        self.batches += 1
+        try:
+            values = await self.batch_load(keys)
+        except Exception as error:
+            for key in keys:
+                # not cached, so a later load asks again
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for key in keys:
+            future = self._futures[key]
+            if future.cancelled():
+                # the caller gave up, a later load asks again
+                del self._futures[key]
+            else:
+                future.set_result(values.get(key))
+
+
+class Loaders:
+    """The loaders of one request, sharing its session"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.users: DataLoader[int, dict] = DataLoader(self._load_users)
+        self.posts: DataLoader[int, dict] = DataLoader(self._load_posts)
+        # loaders dispatching in the same iteration must not share the
+        # session concurrently
+        self._lock = asyncio.Lock()
+
+    async def _load_users(self, ids: List[int]) -> Dict[int, dict]:
+        """PostAuthor documents by user id"""
+        query = select(*AUTHOR_COLUMNS, User.id).where(User.id.in_(ids))
+        async with self._lock:
+            rows = (await self.session.execute(query)).all()
+        names = column_fields(PostAuthor)
+        return {row.id: row_dict(names, row) for row in rows}
+
+    async def _load_posts(self, ids: List[int]) -> Dict[int, dict]:
+        """PostResponse documents, without author, by post id"""
+        query = select(*POST_COLUMNS).where(Post.id.in_(ids))
+        async with self._lock:
+            rows = await fetch_posts(self.session, query, ids)
+        names = column_fields(PostResponse)
+        return {row.id: row_dict(names, row) for row in rows}
+
+    async def embed_authors(self, posts: List[dict]) -> List[dict]:
+        """Sets `author` on post documents and on their nested replies"""
+        documents = []
+        pending = list(posts)
+        while pending:
+            post = pending.pop()
+            documents.append(post)
+            pending.extend(post.get("replies") or ())
+        user_ids = list({post["user_id"] for post in documents})
+        authors = dict(zip(user_ids, await self.users.load_many(user_ids)))
+        for post in documents:
+            post["author"] = authors[post["user_id"]]
+        return posts
+
+    async def encode_posts(self, rows: Iterable) -> bytes:
+        """JSON array of PostResponse documents, with their authors, from
+        rows that start with the `response_columns` of PostResponse"""
+        names = column_fields(PostResponse)
+        return dumps(await self.embed_authors([row_dict(names, row) for row in rows]))
+
+
+def post_document(post: Post) -> dict:
+    """PostResponse document of a post, without author"""
+    return {name: getattr(post, name) for name in column_fields(PostResponse)}
+
+
+async def get_loaders(session: AsyncSession = AsyncReadSession) -> Loaders:
+    return Loaders(session)
+
+
+RequestLoaders = Depends(get_loaders)
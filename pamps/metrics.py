@@ -0,0 +1,14 @@
+"""Runtime metrics registry"""
+from typing import Callable, Dict
+
+_providers: Dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, provider: Callable[[], dict]) -> None:
+    """Registers a callable returning a dict of counters under `name`"""
+    _providers[name] = provider
+
+
+def snapshot() -> Dict[str, dict]:
+    """Collects the current value of every registered provider"""
+    return {name: provider() for name, provider in _providers.items()}
@@ -1,6 +1,6 @@
 from sqlmodel import SQLModel
 
-from .post import Like, Post
+from .post import Hashtag, Like, Mention, Post
 from .user import Social, User
 
-__all__ = ["SQLModel", "User", "Post", "Social", "Like"]
+__all__ = ["SQLModel", "User", "Post", "Social", "Like", "Hashtag", "Mention"]
@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING, List, Optional
 
 from pydantic import BaseModel, Extra
+from sqlalchemy import DDL, Index, UniqueConstraint, event
 from sqlmodel import Field, Relationship, SQLModel
 
 if TYPE_CHECKING:
@@ -13,6 +14,11 @@ if TYPE_CHECKING:
 class Like(SQLModel, table=True):
     """Represents the Like Model"""
 
+    __table_args__ = (
+        UniqueConstraint("user_id", "post_id", name="uq_like_user_id_post_id"),
+        Index("ix_like_post_id", "post_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     user_id: Optional[int] = Field(foreign_key="user.id")
@@ -22,6 +28,12 @@ class Like(SQLModel, table=True):
 class Post(SQLModel, table=True):
     """Represents the Post Model"""
 
+    # (date, id) matches the keyset order of the post listings
+    __table_args__ = (
+        Index("ix_post_user_id_date_id", "user_id", "date", "id"),
+        Index("ix_post_parent_id_date_id", "parent_id", "date", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     text: str
     date: datetime = Field(default_factory=datetime.utcnow, nullable=False)
@@ -29,6 +41,14 @@ class Post(SQLModel, table=True):
     user_id: Optional[int] = Field(foreign_key="user.id")
     parent_id: Optional[int] = Field(foreign_key="post.id")
 
+    # Denormalized counters, maintained by the like buffer and post routes
+    like_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+    reply_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+
     # It populates a `.posts` attribute to the `User` model.
     user: Optional["User"] = Relationship(back_populates="posts")
 
@@ -45,6 +65,76 @@ class Post(SQLModel, table=True):
         return self.date < other.date
 
 
+class Hashtag(SQLModel, table=True):
+    """Represents a #tag used in a post"""
+
+    __table_args__ = (
+        UniqueConstraint("post_id", "tag", name="uq_hashtag_post_id_tag"),
+        Index("ix_hashtag_tag_post_id", "tag", "post_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tag: str = Field(nullable=False)
+
+    post_id: Optional[int] = Field(foreign_key="post.id")
+
+
+class Mention(SQLModel, table=True):
+    """Represents an @username mentioned in a post"""
+
+    __table_args__ = (
+        UniqueConstraint("post_id", "user_id", name="uq_mention_post_id_user_id"),
+        Index("ix_mention_user_id_post_id", "user_id", "post_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    post_id: Optional[int] = Field(foreign_key="post.id")
+    user_id: Optional[int] = Field(foreign_key="user.id")
+
+
+# Full-text search over `Post.text`, queried by `pamps.search`. Postgres
+# indexes the tsvector expression, SQLite keeps an FTS5 table in sync with
+# triggers. The `text_search` migration creates the same objects.
+POST_SEARCH_DDL = {
+    "postgresql": [
+        "CREATE INDEX ix_post_text_search ON post "
+        "USING gin (to_tsvector('english', text))",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE post_fts USING fts5("
+        "text, content='post', content_rowid='id')",
+        "CREATE TRIGGER post_fts_insert AFTER INSERT ON post BEGIN "
+        "INSERT INTO post_fts (rowid, text) VALUES (new.id, new.text); END",
+        "CREATE TRIGGER post_fts_delete AFTER DELETE ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); END",
+        "CREATE TRIGGER post_fts_update AFTER UPDATE OF text ON post BEGIN "
+        "INSERT INTO post_fts (post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO post_fts (rowid, text) VALUES (new.id, new.text); END",
+    ],
+}
+
+for dialect, statements in POST_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(
+            Post.__table__, "after_create", DDL(statement).execute_if(dialect=dialect)
+        )
+event.listen(
+    Post.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS post_fts").execute_if(dialect="sqlite"),
+)
+
+
+class PostAuthor(BaseModel):
+    """Serializer for the author embedded in a post"""
+
+    username: str
+    avatar: Optional[str] = None
+
+
 class PostResponse(BaseModel):
     """Serializer for Post Response"""
 
@@ -53,6 +143,17 @@ class PostResponse(BaseModel):
     date: datetime
     user_id: int
     parent_id: Optional[int]
+    like_count: int = 0
+    reply_count: int = 0
+    # filled in by `pamps.loaders`
+    author: Optional[PostAuthor] = None
+
+
+class PostBatch(BaseModel):
+    """Serializer for posts looked up by id"""
+
+    items: List[PostResponse]
+    missing: List[int]
 
 
 class PostResponseWithReplies(PostResponse):
@@ -62,6 +163,16 @@ class PostResponseWithReplies(PostResponse):
         orm_mode = True
 
 
+class PostThread(PostResponse):
+    """Serializer for a post with its whole reply tree"""
+
+    depth: int = 0
+    replies: List["PostThread"] = []
+
+
+PostThread.update_forward_refs()
+
+
 class PostRequest(BaseModel):
     """Serializer for Post request payload"""
 
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING, List, Optional
 
 from pydantic import BaseModel
+from sqlalchemy import DDL, Index, UniqueConstraint, event
 from sqlmodel import Field, Relationship, SQLModel
 
 from pamps.security import HashedPassword
@@ -19,17 +20,95 @@ class User(SQLModel, table=True):
     avatar: Optional[str] = None
     bio: Optional[str] = None
     password: HashedPassword = Field(nullable=False)
+    # Denormalized counters, maintained by the follow routes
+    follower_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+    following_count: int = Field(
+        default=0, nullable=False, sa_column_kwargs={"server_default": "0"}
+    )
+    # username_key(username), set on every insert and update
+    username_key: Optional[str] = None
 
     # it populates the .user attributes with the Post Model
     posts: List["Post"] = Relationship(back_populates="user")
 
 
+def username_key(username: str) -> str:
+    """Lowercased username the typeahead matches prefixes against. Folded in
+    Python, SQLite's lower() only folds ASCII."""
+    return username.lower()
+
+
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+def _set_username_key(mapper, connection, target: User) -> None:
+    target.username_key = username_key(target.username)
+
+
+# Prefix index for the username typeahead, queried by `pamps.typeahead`
+# with range conditions on username_key. On Postgres the "C" collation
+# orders it by code point like text_pattern_ops does, so it serves the
+# ORDER BY of the query as well. The `username_prefix` migration creates
+# the same indexes.
+USERNAME_PREFIX_DDL = {
+    "postgresql": 'CREATE INDEX ix_user_username_prefix ON "user" '
+    '((username_key COLLATE "C"))',
+    "sqlite": 'CREATE INDEX ix_user_username_prefix ON "user" (username_key)',
+}
+
+for dialect, statement in USERNAME_PREFIX_DDL.items():
+    event.listen(
+        User.__table__, "after_create", DDL(statement).execute_if(dialect=dialect)
+    )
+
+
 class UserResponse(BaseModel):
     """Serializer for User response"""
 
     username: str
     avatar: Optional[str] = None
     bio: Optional[str] = None
+    follower_count: int = 0
+    following_count: int = 0
+
+
+class UserBatch(BaseModel):
+    """Serializer for users looked up by username"""
+
+    items: List[UserResponse]
+    missing: List[str]
+
+
+class UserSuggestion(UserResponse):
+    """Serializer for a user to follow"""
+
+    # how many of the users you follow follow them
+    followed_by: int
+
+
+class FollowStatus(BaseModel):
+    """Serializer for the follows between the current user and another"""
+
+    following: bool
+    followed_by: bool
+    mutual: bool
+
+
+class BulkFollowRequest(BaseModel):
+    """Serializer for following or unfollowing many users at once"""
+
+    user_ids: List[int]
+    unfollow: bool = False
+
+
+class BulkFollowResponse(BaseModel):
+    """Serializer for the outcome of a bulk follow"""
+
+    # follows created or removed
+    changed: int
+    # ids that are not users, or are the requester
+    ignored: List[int]
 
 
 class UserRequest(BaseModel):
@@ -45,6 +124,11 @@ class UserRequest(BaseModel):
 class Social(SQLModel, table=True):
     """Represents the Social Model"""
 
+    __table_args__ = (
+        UniqueConstraint("from_id", "to_id", name="uq_social_from_id_to_id"),
+        Index("ix_social_to_id_from_id", "to_id", "from_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     date: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
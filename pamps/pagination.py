@@ -0,0 +1,92 @@
+"""Keyset (cursor) pagination"""
+import base64
+import binascii
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import Depends, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError, parse_obj_as
+from sqlalchemy import tuple_
+
+from pamps.config import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams(BaseModel):
+    cursor: Optional[str] = None
+    limit: int
+    descending: bool = False
+
+
+def get_page_params(
+    cursor: Optional[str] = None,
+    limit: int = Query(
+        settings.pagination.default_limit, ge=1, le=settings.pagination.max_limit
+    ),
+) -> PageParams:
+    return PageParams(cursor=cursor, limit=limit)
+
+
+def get_ordered_page_params(
+    cursor: Optional[str] = None,
+    limit: int = Query(
+        settings.pagination.default_limit, ge=1, le=settings.pagination.max_limit
+    ),
+    order: str = Query("asc", regex="^(asc|desc)$"),
+) -> PageParams:
+    """Page params of the listings that can also be read newest first"""
+    return PageParams(cursor=cursor, limit=limit, descending=order == "desc")
+
+
+Page = Depends(get_page_params)
+OrderedPage = Depends(get_ordered_page_params)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Opaque cursor for the key values of the last row of a page"""
+    raw = json.dumps(jsonable_encoder(list(values)), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Tuple[type, ...]) -> tuple:
+    """Key values of a cursor, parsed back to the types of the key columns"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return parse_obj_as(Tuple[types], json.loads(raw))
+    except (binascii.Error, ValueError, ValidationError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset(query, columns: Sequence, page: PageParams, descending: bool = False):
+    """Orders `query` by `columns` and restricts it to the requested page.
+
+    One extra row is fetched to know whether there is a next page.
+    """
+    if page.cursor is not None:
+        types = tuple(column.type.python_type for column in columns)
+        key, cursor = tuple_(*columns), decode_cursor(page.cursor, types)
+        query = query.where(key < cursor if descending else key > cursor)
+        # implied by the row comparison, but only a plain bound on the first
+        # column lets the planner use it for index ranges and partition pruning
+        first = columns[0]
+        query = query.where(first <= cursor[0] if descending else first >= cursor[0])
+    if descending:
+        columns = [column.desc() for column in columns]
+    return query.order_by(*columns).limit(page.limit + 1)
+
+
+def paginate(
+    rows: List, columns: Sequence, page: PageParams, response: Response
+) -> List:
+    """Trims the extra row fetched by `keyset` and exposes the cursor of the
+    next page in the X-Next-Cursor header"""
+    if len(rows) <= page.limit:
+        return rows
+    rows = rows[: page.limit]
+    last = rows[-1]
+    response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+        [getattr(last, column.key) for column in columns]
+    )
+    return rows
@@ -0,0 +1,289 @@
+"""Monthly range partitions of `post` on Postgres.
+
+The `partition_posts_by_month` migration turns `post` into a table
+partitioned by `date`, with one partition per month named `post_yYYYYmMM`
+and a `post_default` partition for dates no monthly partition covers.
+Partitions for the coming `partitions.months_ahead` months are created by
+`pamps create-partitions`, meant to run from cron on one host: creating a
+partition, and moving rows out of `post_default`, takes an ACCESS EXCLUSIVE
+lock on `post`, so the API workers never run that DDL. Runs that overlap
+wait on each other through an advisory lock. `pamps archive-partitions`
+detaches old months, leaving them as plain tables to dump or drop.
+
+The primary key is (id, date), so a lookup by id alone probes every
+partition. `post_months` keeps the id range of each month and turns the
+ids of a lookup into a date range Postgres prunes the partitions with,
+see `fetch_posts` and `update_posts`.
+
+On other databases, or before the migration, `post` is a plain table and
+these helpers do nothing.
+"""
+import asyncio
+import logging
+from datetime import date
+from typing import Collection, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps import metrics
+from pamps.config import settings
+from pamps.db import async_engine
+from pamps.models.post import Post
+
+log = logging.getLogger(__name__)
+
+Month = Tuple[int, int]  # (year, month)
+
+# pg_advisory_xact_lock key serializing the partition DDL of concurrent runs
+PARTITION_LOCK = 0x706F7374  # "post"
+
+
+def month_of(day: date) -> Month:
+    return day.year, day.month
+
+
+def add_months(month: Month, count: int) -> Month:
+    year, index = divmod(month[0] * 12 + month[1] - 1 + count, 12)
+    return year, index + 1
+
+
+def partition_name(month: Month) -> str:
+    return "post_y%04dm%02d" % month
+
+
+def partition_month(name: str) -> Optional[Month]:
+    """The month of a monthly partition name, None for other tables"""
+    if len(name) != 13 or not name.startswith("post_y") or name[10] != "m":
+        return None
+    return int(name[6:10]), int(name[11:13])
+
+
+def create_partition_sql(month: Month) -> str:
+    start = date(*month, 1)
+    end = date(*add_months(month, 1), 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF post "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def is_partitioned(connection: Connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    query = text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('post')"
+    )
+    return connection.execute(query).first() is not None
+
+
+def list_partitions(connection: Connection) -> List[str]:
+    """Names of the partitions attached to `post`"""
+    if not is_partitioned(connection):
+        return []
+    query = text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'post'::regclass ORDER BY child.relname"
+    )
+    return list(connection.execute(query).scalars())
+
+
+def lock_partitions(connection: Connection) -> None:
+    """Waits for the partition DDL of other runs, until the transaction ends"""
+    connection.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK}
+    )
+
+
+def create_partition(connection: Connection, month: Month) -> None:
+    """Creates the partition of `month`.
+
+    Postgres refuses to create it while `post_default` holds rows of that
+    month, those are moved to the new partition with the default detached.
+    """
+    start, end = date(*month, 1), date(*add_months(month, 1), 1)
+    bounds = {"start": start, "end": end}
+    in_month = "date >= :start AND date < :end"
+    query = text(f"SELECT 1 FROM post_default WHERE {in_month} LIMIT 1")
+    if connection.execute(query, bounds).first() is None:
+        connection.execute(text(create_partition_sql(month)))
+        return
+    log.warning("Moving the rows of %s out of post_default", partition_name(month))
+    connection.execute(text("ALTER TABLE post DETACH PARTITION post_default"))
+    connection.execute(text(create_partition_sql(month)))
+    connection.execute(
+        text(f"INSERT INTO post SELECT * FROM post_default WHERE {in_month}"), bounds
+    )
+    connection.execute(text(f"DELETE FROM post_default WHERE {in_month}"), bounds)
+    connection.execute(text("ALTER TABLE post ATTACH PARTITION post_default DEFAULT"))
+
+
+def create_partitions(
+    connection: Connection, months_ahead: int, today: Optional[date] = None
+) -> List[str]:
+    """Creates the partitions of this month and of the next `months_ahead`
+    months that do not exist yet, returns their names"""
+    if not is_partitioned(connection):
+        return []
+    lock_partitions(connection)
+    existing = set(list_partitions(connection))
+    current = month_of(today or date.today())
+    created = []
+    for count in range(months_ahead + 1):
+        month = add_months(current, count)
+        if partition_name(month) not in existing:
+            create_partition(connection, month)
+            created.append(partition_name(month))
+    return created
+
+
+def archive_partitions(connection: Connection, before: date) -> List[str]:
+    """Detaches the monthly partitions that end on or before `before`,
+    returns their names"""
+    archived = []
+    if is_partitioned(connection):
+        lock_partitions(connection)
+    for name in list_partitions(connection):
+        month = partition_month(name)
+        if month is not None and date(*add_months(month, 1), 1) <= before:
+            connection.execute(text(f"ALTER TABLE post DETACH PARTITION {name}"))
+            archived.append(name)
+    return archived
+
+
+class PostMonths:
+    """Id ranges of the monthly partitions.
+
+    Ids come from one sequence and posts are dated when they are created,
+    so every month holds a contiguous range of ids. The ranges are a
+    snapshot: ids above it belong to the newest month of the snapshot or a
+    later one. Lookups that miss are retried on every partition, for posts
+    dated out of order.
+    """
+
+    def __init__(self):
+        # (min id, max id, first day) of the months holding posts, by month
+        self.months: List[Tuple[int, int, date]] = []
+        # min and max id in post_default, which can hold any date
+        self.default: Optional[Tuple[int, int]] = None
+        self.retries = 0
+
+    def load(self, connection: Connection) -> None:
+        months, default = [], None
+        for name in list_partitions(connection):
+            query = text(f"SELECT min(id), max(id) FROM {name}")
+            low, high = connection.execute(query).one()
+            if low is None:
+                continue
+            month = partition_month(name)
+            if month is None:
+                default = (low, high)
+            else:
+                months.append((low, high, date(*month, 1)))
+        self.months, self.default = sorted(months, key=lambda m: m[2]), default
+
+    def date_range(self, ids: Collection[int]) -> Optional[Tuple[date, Optional[date]]]:
+        """[start, end) of the months that can hold `ids`, end is None when
+        it is open, None when every partition can"""
+        if not self.months or not ids:
+            return None
+        if self.default and any(self.default[0] <= i <= self.default[1] for i in ids):
+            return None
+        top = max(self.months, key=lambda m: m[1])
+        starts, ends = [], []
+        for post_id in ids:
+            if post_id > top[1]:
+                starts.append(top[2])
+                ends.append(None)
+                continue
+            months = [m[2] for m in self.months if m[0] <= post_id <= m[1]]
+            if not months:
+                return None
+            starts.append(min(months))
+            ends.append(date(*add_months(month_of(max(months)), 1), 1))
+        return min(starts), None if None in ends else max(ends)
+
+    def conditions(self, ids: Collection[int]) -> list:
+        """Conditions on `Post.date` restricting a lookup of `ids` to the
+        partitions that can hold them"""
+        bounds = self.date_range(ids)
+        if bounds is None:
+            return []
+        start, end = bounds
+        if end is None:
+            return [Post.date >= start]
+        return [Post.date >= start, Post.date < end]
+
+    def stats(self) -> dict:
+        return {"months": len(self.months), "retries": self.retries}
+
+
+post_months = PostMonths()
+metrics.register("post_months", post_months.stats)
+
+
+async def fetch_posts(session: AsyncSession, query, ids: Collection[int]) -> List:
+    """Rows of `query`, which selects posts, or rows with their `id`, among
+    `ids`, read from the partitions that can hold them"""
+    conditions = post_months.conditions(ids)
+    rows = list((await session.exec(query.where(*conditions))).all())
+    if conditions:
+        found = {row.id for row in rows}
+        missing = [post_id for post_id in ids if post_id not in found]
+        if missing:
+            post_months.retries += 1
+            query = query.where(Post.id.in_(missing))
+            rows.extend((await session.exec(query)).all())
+    return rows
+
+
+async def update_posts(session: AsyncSession, statement, ids: Collection[int]) -> None:
+    """Runs `statement`, an UPDATE of the posts among `ids`, on the
+    partitions that can hold them"""
+    conditions = post_months.conditions(ids)
+    if not conditions:
+        await session.execute(statement)
+        return
+    # conditions are only set on a partitioned Postgres table, which has
+    # RETURNING
+    result = await session.execute(statement.where(*conditions).returning(Post.id))
+    updated = set(result.scalars())
+    missing = [post_id for post_id in ids if post_id not in updated]
+    if missing:
+        post_months.retries += 1
+        await session.execute(statement.where(Post.id.in_(missing)))
+
+
+class PostMonthsReloader:
+    """Reloads `post_months` every `reload_interval` seconds, to follow the
+    partitions `pamps create-partitions` adds. It only reads the catalog and
+    the id ranges, no lock is taken on `post`."""
+
+    def __init__(self, reload_interval: float = 3600):
+        self.reload_interval = reload_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with async_engine.connect() as connection:
+                    await connection.run_sync(post_months.load)
+            except Exception:
+                log.exception("Failed to load the post partitions")
+            await asyncio.sleep(self.reload_interval)
+
+    def start(self) -> None:
+        if async_engine.dialect.name == "postgresql" and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+post_months_reloader = PostMonthsReloader(
+    reload_interval=settings.partitions.reload_minutes * 60
+)
@@ -0,0 +1,264 @@
+"""HTTP response cache with strong ETags and tag based invalidation.
+
+Read routes look a request up before querying and store the serialized
+body afterwards, tagged with what it contains (e.g. `post:1`). Writes
+invalidate those tags. The store is an in-process LRU by default, or any
+server speaking the Redis protocol when `response_cache.backend = "redis"`.
+
+A replica can still serve the old rows for a while after a write, so an
+invalidated tag is held for `hold` seconds (the read-your-writes window),
+and a response read from a replica that carries a held tag is served but
+not stored.
+"""
+import hashlib
+import json
+import math
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+from pamps import metrics
+from pamps.cache import TTLCache
+from pamps.config import settings
+
+# headers set by the routes that are part of the cached response
+CACHED_HEADERS = ("x-next-cursor",)
+
+
+class MemoryBackend:
+    """In-process LRU backend"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60, hold: float = 0):
+        self.entries = TTLCache(max_size=max_size, ttl=ttl, on_evict=self._forget)
+        self.held_tags = TTLCache(max_size=max_size, ttl=hold)
+        self._tags: Dict[str, Set[str]] = defaultdict(set)
+        # tags of every cached key, to unlink keys that leave the cache
+        self._key_tags: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def _forget(self, key: str, entry: dict) -> None:
+        with self._lock:
+            self._unlink(key)
+
+    def _unlink(self, key: str) -> None:
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    async def set(self, key: str, entry: dict, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        with self._lock:
+            self._unlink(key)
+            self._key_tags[key] = tags
+            for tag in tags:
+                self._tags[tag].add(key)
+        self.entries.set(key, entry)
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        with self._lock:
+            keys = set().union(*(self._tags.get(tag, ()) for tag in tags))
+            for key in keys:
+                self._unlink(key)
+        for key in keys:
+            self.entries.invalidate(key)
+        if self.held_tags.ttl > 0:
+            for tag in tags:
+                self.held_tags.set(tag, True)
+
+    async def is_held(self, tags: Iterable[str]) -> bool:
+        return any(self.held_tags.get(tag) for tag in tags)
+
+    async def clear(self) -> None:
+        self.entries.clear()
+        self.held_tags.clear()
+        with self._lock:
+            self._tags.clear()
+            self._key_tags.clear()
+
+
+class RedisBackend:
+    """Backend for servers speaking the Redis protocol.
+
+    `client` is a `redis.asyncio.Redis` compatible object, one is created
+    from `url` when it is not given.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        url: str = "",
+        ttl: float = 60,
+        prefix: str = "pamps",
+        hold: float = 0,
+    ):
+        if client is None:
+            try:
+                from redis.asyncio import Redis
+            except ImportError:  # pragma: no cover
+                raise RuntimeError("The redis response cache requires `redis`")
+            client = Redis.from_url(url)
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.hold = int(math.ceil(hold))
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}:{kind}:{name}"
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self.client.get(self._key("response", key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, entry: dict, tags: Iterable[str]) -> None:
+        key = self._key("response", key)
+        await self.client.set(key, json.dumps(entry), ex=self.ttl)
+        for tag in tags:
+            await self.client.sadd(self._key("tag", tag), key)
+            await self.client.expire(self._key("tag", tag), self.ttl)
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        for tag in tags:
+            tag_key = self._key("tag", tag)
+            keys = await self.client.smembers(tag_key)
+            await self.client.delete(tag_key, *keys)
+            if self.hold > 0:
+                await self.client.set(self._key("held", tag), "1", ex=self.hold)
+
+    async def is_held(self, tags: Iterable[str]) -> bool:
+        keys = [self._key("held", tag) for tag in tags]
+        return bool(keys) and await self.client.exists(*keys) > 0
+
+    async def clear(self) -> None:
+        keys = [key async for key in self.client.scan_iter(f"{self.prefix}:*")]
+        if keys:
+            await self.client.delete(*keys)
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the If-None-Match header of `request` covers `etag`"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip() for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """Caches serialized read responses and answers conditional requests"""
+
+    def __init__(self, backend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.held = 0
+
+    @staticmethod
+    def key(request: Request) -> str:
+        query = "&".join(sorted(str(request.query_params).split("&")))
+        return f"{request.url.path}?{query}"
+
+    def _respond(self, request: Request, entry: dict) -> Response:
+        headers = {**entry["headers"], "ETag": entry["etag"]}
+        if etag_matches(request, entry["etag"]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry["body"], media_type="application/json", headers=headers)
+
+    async def lookup(self, request: Request) -> Optional[Response]:
+        """The cached response for `request`, or None on a miss"""
+        if not self.enabled:
+            return None
+        entry = await self.backend.get(self.key(request))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._respond(request, entry)
+
+    async def store(
+        self,
+        request: Request,
+        response: Response,
+        model: Any,
+        content: Any,
+        tags: Iterable[str],
+    ) -> Response:
+        """Serializes `content` as `model`, caches it under `tags` and
+        returns it, or a 304 when the client already has this version"""
+        body = JSONResponse(jsonable_encoder(parse_obj_as(model, content))).body
+        return await self.store_body(request, response, body, tags)
+
+    async def store_body(
+        self,
+        request: Request,
+        response: Response,
+        body: bytes,
+        tags: Iterable[str],
+    ) -> Response:
+        """Same as `store` for an already serialized JSON body"""
+        entry = {
+            "body": body.decode(),
+            "etag": make_etag(body),
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name in CACHED_HEADERS
+            },
+        }
+        tags = set(tags)
+        if self.enabled:
+            if getattr(request.state, "read_replica", False) and (
+                await self.backend.is_held(tags)
+            ):
+                # the replica may not have the write that invalidated it yet
+                self.held += 1
+            else:
+                await self.backend.set(self.key(request), entry, tags)
+        return self._respond(request, entry)
+
+    async def invalidate(self, *tags: str) -> None:
+        if self.enabled:
+            await self.backend.invalidate(tags)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "held": self.held,
+        }
+
+
+def make_backend():
+    config = settings.response_cache
+    hold = settings.db.read_your_writes_seconds
+    if config.backend == "redis":
+        return RedisBackend(url=config.redis_url, ttl=config.ttl, hold=hold)
+    return MemoryBackend(max_size=config.max_size, ttl=config.ttl, hold=hold)
+
+
+response_cache = ResponseCache(make_backend(), enabled=settings.response_cache.enabled)
+metrics.register("response_cache", response_cache.stats)
+
+
+def post_tags(posts: Iterable[Any]) -> Set[str]:
+    """Tags of a response containing `posts`"""
+    return {f"post:{post.id}" for post in posts}
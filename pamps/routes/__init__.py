@@ -1,7 +1,9 @@
 from fastapi import APIRouter
 
 from .auth import router as auth_router
+from .metrics import router as metrics_router
 from .post import router as post_router
+from .stream import router as stream_router
 from .user import router as user_router
 
 main_router = APIRouter()
@@ -9,3 +11,5 @@ main_router = APIRouter()
 main_router.include_router(auth_router, prefix="", tags=["auth"])
 main_router.include_router(user_router, prefix="/user", tags=["user"])
 main_router.include_router(post_router, prefix="/post", tags=["post"])
+main_router.include_router(stream_router, prefix="/stream", tags=["stream"])
+main_router.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
@@ -25,7 +25,7 @@ router = APIRouter()
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = authenticate_user(get_user, form_data.username, form_data.password)
+    user = await authenticate_user(get_user, form_data.username, form_data.password)
     if not user or not isinstance(user, User):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+
+from pamps import metrics
+
+router = APIRouter()
+
+
+@router.get("/")
+async def get_metrics():
+    """Runtime counters of caches, pools and buffers"""
+    return metrics.snapshot()
@@ -1,138 +1,396 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, Request, Response
 from fastapi.exceptions import HTTPException
-from sqlmodel import Session, select
+from sqlalchemy import update
+from sqlalchemy.orm import selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from pamps.auth import AuthenticatedUser
-from pamps.db import ActiveSession
+from pamps.broker import publish_post
+from pamps.config import settings
+from pamps.db import AsyncActiveSession, AsyncReadSession, pin_to_primary
+from pamps.likes import like_buffer
+from pamps.loaders import Loaders, RequestLoaders, post_document
 from pamps.models.post import (
+    Hashtag,
     Like,
+    Mention,
     Post,
+    PostBatch,
     PostRequest,
     PostResponse,
     PostResponseWithReplies,
+    PostThread,
 )
 from pamps.models.user import User
+from pamps.pagination import OrderedPage, Page, PageParams, keyset, paginate
+from pamps.partitions import fetch_posts, update_posts
+from pamps.response_cache import post_tags, response_cache
+from pamps.search import search_posts
+from pamps.serialization import dumps, json_response, response_columns
+from pamps.streaming import stream_ndjson, wants_ndjson
+from pamps.tags import index_posts, normalize_tag
+from pamps.threads import get_thread
+from pamps.timeline import fan_out, read_feed
+from pamps.trending import trending
 
 router = APIRouter()
 
+# Stable keyset order of every post listing, `?order=desc` reads it newest
+# first, so the first pages only touch the latest partitions
+POST_KEY = (Post.date, Post.id)
+# List routes select these and encode the rows directly, see pamps.serialization
+POST_COLUMNS = response_columns(PostResponse, Post)
+
+
+def list_posts_query(page: PageParams):
+    query = select(*POST_COLUMNS).where(Post.parent == None)  # noqa: E711
+    return keyset(query, POST_KEY, page, descending=page.descending)
+
+
+def tag_posts_query(tag: str, page: PageParams):
+    query = (
+        select(*POST_COLUMNS)
+        .join(Hashtag, Hashtag.post_id == Post.id)
+        .where(Hashtag.tag == normalize_tag(tag))
+    )
+    return keyset(query, POST_KEY, page, descending=page.descending)
+
+
+def mention_posts_query(username: str, page: PageParams):
+    query = (
+        select(*POST_COLUMNS)
+        .join(Mention, Mention.post_id == Post.id)
+        .join(User, User.id == Mention.user_id)
+        .where(User.username == username)
+    )
+    return keyset(query, POST_KEY, page, descending=page.descending)
+
+
+def user_posts_query(username: str, include_replies: bool, page: PageParams):
+    filters = [User.username == username]
+    if not include_replies:
+        filters.append(Post.parent == None)  # noqa: E711
+    query = select(*POST_COLUMNS).join(User).where(*filters)
+    return keyset(query, POST_KEY, page, descending=page.descending)
+
+
+def liked_posts_query(username: str, page: PageParams):
+    subquery = (
+        select(Like.post_id)
+        .join(User, User.id == Like.user_id)
+        .where(User.username == username)
+        .subquery()
+    )
+    query = select(*POST_COLUMNS).join(subquery, Post.id == subquery.c.post_id)
+    return keyset(query, POST_KEY, page, descending=page.descending)
+
+
+async def get_post(session: AsyncSession, post_id: int, *options) -> Optional[Post]:
+    """Post by id, read again from the database when already loaded"""
+    query = (
+        select(Post)
+        .where(Post.id == post_id)
+        .options(*options)
+        .execution_options(populate_existing=True)
+    )
+    posts = await fetch_posts(session, query, [post_id])
+    return posts[0] if posts else None
+
 
 @router.get("/", response_model=List[PostResponse])
-async def list_posts(*, session: Session = ActiveSession):
+async def list_posts(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    page: PageParams = OrderedPage,
+    request: Request,
+    response: Response,
+):
     """List all posts without replies"""
-    query = select(Post).where(Post.parent == None)  # noqa: E711
-    posts = session.exec(query).all()
-    return posts
+    query = list_posts_query(page)
+    if wants_ndjson(request):
+        return stream_ndjson(session, query, PostResponse, authors=True)
+    if cached := await response_cache.lookup(request):
+        return cached
+    posts = (await session.execute(query)).all()
+    posts = paginate(posts, POST_KEY, page, response)
+    tags = {"posts", *post_tags(posts)}
+    return await response_cache.store_body(
+        request, response, await loaders.encode_posts(posts), tags
+    )
+
+
+@router.get("/feed/", response_model=List[PostResponse])
+async def get_feed(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    user: User = AuthenticatedUser,
+    page: PageParams = Page,
+    response: Response,
+):
+    """Home timeline: newest posts of the user and of the users they follow"""
+    posts = await read_feed(session, user.id, page)
+    posts = paginate(posts, POST_KEY, page, response)
+    return await loaders.embed_authors([post_document(post) for post in posts])
+
+
+@router.get("/trending/", response_model=List[PostResponse])
+async def get_trending_posts(
+    *,
+    loaders: Loaders = RequestLoaders,
+    limit: int = Query(
+        settings.pagination.default_limit, ge=1, le=settings.trending.size
+    ),
+):
+    """Recent posts with the most likes and replies, decayed by age"""
+    if trending.refreshed_at is None:
+        await trending.refresh()
+    posts = trending.top(limit)
+    return await loaders.embed_authors([post_document(post) for post in posts])
+
+
+@router.get("/search/", response_model=List[PostResponse])
+async def search_posts_by_text(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    q: str = Query(..., min_length=1),
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    page: PageParams = Page,
+    response: Response,
+):
+    """Full-text search over posts, best matches first"""
+    posts = await search_posts(
+        session, q, page, response, username=username, since=since, until=until
+    )
+    return await loaders.embed_authors([post_document(post) for post in posts])
+
+
+@router.get("/tag/{tag}/", response_model=List[PostResponse])
+async def get_posts_by_tag(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    tag: str,
+    page: PageParams = OrderedPage,
+    response: Response,
+):
+    """Get posts using #tag"""
+    posts = (await session.execute(tag_posts_query(tag, page))).all()
+    posts = paginate(posts, POST_KEY, page, response)
+    return json_response(await loaders.encode_posts(posts), response)
+
+
+@router.get("/mentions/{username}/", response_model=List[PostResponse])
+async def get_posts_mentioning_username(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    username: str,
+    page: PageParams = OrderedPage,
+    response: Response,
+):
+    """Get posts mentioning @username"""
+    posts = (await session.execute(mention_posts_query(username, page))).all()
+    posts = paginate(posts, POST_KEY, page, response)
+    return json_response(await loaders.encode_posts(posts), response)
+
+
+@router.get("/batch/", response_model=PostBatch)
+async def get_posts_by_id(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    response: Response,
+    ids: List[int] = Query(...),
+):
+    """Posts with the given ids, in the order asked"""
+    if len(ids) > settings.batch.max_keys:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.batch.max_keys} ids are allowed",
+        )
+    ids = list(dict.fromkeys(ids))
+    posts = await loaders.posts.load_many(ids)
+    body = {
+        "items": await loaders.embed_authors([post for post in posts if post]),
+        "missing": [post_id for post_id, post in zip(ids, posts) if not post],
+    }
+    return json_response(dumps(body), response)
 
 
 @router.get("/{post_id}/", response_model=PostResponseWithReplies)
 async def get_post_by_post_id(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
     post_id: int,
+    request: Request,
+    response: Response,
 ):
     """Get post by post_id"""
-    query = select(Post).where(Post.id == post_id)
-    post = session.exec(query).first()
+    if cached := await response_cache.lookup(request):
+        return cached
+    post = await get_post(session, post_id, selectinload(Post.replies))
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    return post
+    tags = post_tags([post, *post.replies])
+    document = post_document(post)
+    document["replies"] = [post_document(reply) for reply in post.replies]
+    await loaders.embed_authors([document])
+    return await response_cache.store(
+        request, response, PostResponseWithReplies, document, tags
+    )
+
+
+@router.get("/{post_id}/thread/", response_model=PostThread)
+async def get_post_thread(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
+    post_id: int,
+    max_depth: int = Query(
+        settings.thread.max_depth, ge=1, le=settings.thread.max_depth
+    ),
+    max_breadth: Optional[int] = Query(None, ge=1),
+):
+    """Get post with its whole reply tree"""
+    thread = await get_thread(session, post_id, max_depth, max_breadth)
+    if not thread:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await loaders.embed_authors([thread])
+    return thread
 
 
 @router.get("/user/{username}/", response_model=List[PostResponse])
 async def get_posts_by_username(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
     username: str,
     include_replies: bool = False,
+    page: PageParams = OrderedPage,
+    request: Request,
+    response: Response,
 ):
     """Get posts by username"""
-    filters = [User.username == username]
-    if not include_replies:
-        filters.append(Post.parent == None)  # noqa: E711
-    query = select(Post).join(User).where(*filters)
-    posts = session.exec(query).all()
-    return posts
+    query = user_posts_query(username, include_replies, page)
+    if wants_ndjson(request):
+        return stream_ndjson(session, query, PostResponse, authors=True)
+    if cached := await response_cache.lookup(request):
+        return cached
+    posts = (await session.execute(query)).all()
+    posts = paginate(posts, POST_KEY, page, response)
+    tags = {f"posts:user:{username}", *post_tags(posts)}
+    return await response_cache.store_body(
+        request, response, await loaders.encode_posts(posts), tags
+    )
 
 
 @router.post("/", response_model=PostResponse, status_code=201)
 async def create_post(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     user: User = AuthenticatedUser,
     post: PostRequest,
 ):
     """Creates new post"""
 
     post.user_id = user.id
+    # post.parent_id has no foreign key once post is partitioned
+    if post.parent_id and not await get_post(session, post.parent_id):
+        raise HTTPException(status_code=404, detail="Parent post not found")
 
     db_post = Post.from_orm(post)  # transform PostRequest in Post
     session.add(db_post)
-    session.commit()
-    session.refresh(db_post)
-    return db_post
+    if db_post.parent_id:
+        await update_posts(
+            session,
+            update(Post)
+            .where(Post.id == db_post.parent_id)
+            .values(reply_count=Post.reply_count + 1)
+            .execution_options(synchronize_session=False),
+            [db_post.parent_id],
+        )
+    await session.flush()
+    await session.run_sync(index_posts, [db_post])
+    await session.commit()
+    await fan_out(session, db_post)
+    document = post_document(db_post)
+    document["author"] = {"username": user.username, "avatar": user.avatar}
+    await publish_post(document)
+    if db_post.parent_id:
+        await response_cache.invalidate(f"post:{db_post.parent_id}")
+    else:
+        await response_cache.invalidate("posts")
+    await response_cache.invalidate(f"posts:user:{user.username}")
+    return document
 
 
 @router.get("/likes/{username}/", response_model=List[PostResponse])
 async def get_user_post_likes_by_username(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncReadSession,
+    loaders: Loaders = RequestLoaders,
     username: str,
+    page: PageParams = OrderedPage,
+    response: Response,
 ):
-    subquery = (
-        select(Like.post_id)
-        .join(User, User.id == Like.user_id)
-        .where(User.username == username)
-        .subquery()
-    )
-
-    query = select(Post).join(subquery, Post.id == subquery.c.post_id)
-
-    posts = session.execute(query)
-    return posts.scalars().all()
+    posts = (await session.execute(liked_posts_query(username, page))).all()
+    posts = paginate(posts, POST_KEY, page, response)
+    return json_response(await loaders.encode_posts(posts), response)
 
 
 @router.post("/{post_id}/like/", response_model=PostResponse, status_code=201)
 async def like_post(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     user: User = AuthenticatedUser,
     post_id: int,
 ):
     """Likes a post"""
-    post = session.exec(select(Post).where(Post.id == post_id)).first()
+    post = await get_post(session, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    like = Like(user_id=user.id, post_id=post_id)
-    session.add(like)
-    session.commit()
+    # the like is written by the buffer, outside of this session
+    pin_to_primary(session.info.get("subject"))
+    if await like_buffer.like(user.id, post_id):
+        post = await get_post(session, post_id)
 
-    db_post = Post.from_orm(post)
-    return db_post
+    (document,) = await Loaders(session).embed_authors([post_document(post)])
+    return document
 
 
 @router.delete("/{post_id}/like/", response_model=PostResponse, status_code=201)
 async def dislike_post(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     user: User = AuthenticatedUser,
     post_id: int,
 ):
     """Dislikes a post"""
-    post = session.exec(select(Post).where(Post.id == post_id)).first()
+    post = await get_post(session, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    like = session.exec(
-        select(Like).where(Like.user_id == user.id, Like.post_id == post.id)
-    ).first()
-
-    if not like:
+    liked = like_buffer.state(user.id, post_id)
+    if liked is None:
+        query = select(Like.id).where(Like.user_id == user.id, Like.post_id == post_id)
+        liked = (await session.exec(query)).first() is not None
+    if not liked:
         raise HTTPException(status_code=404, detail="Like not found")
 
-    session.delete(like)
-    session.commit()
-    db_post = Post.from_orm(post)
-    return db_post
+    pin_to_primary(session.info.get("subject"))
+    if await like_buffer.unlike(user.id, post_id):
+        post = await get_post(session, post_id)
+
+    (document,) = await Loaders(session).embed_authors([post_document(post)])
+    return document
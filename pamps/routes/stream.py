@@ -0,0 +1,146 @@
+import asyncio
+from typing import Optional
+
+import orjson
+from fastapi import APIRouter, HTTPException, Request, WebSocket, status
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps.auth import AuthenticatedUser, get_current_user
+from pamps.broker import Subscription, broker
+from pamps.config import settings
+from pamps.db import async_session_factory
+from pamps.models.post import Post
+from pamps.models.user import Social, User
+from pamps.partitions import fetch_posts
+
+router = APIRouter()
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+async def feed_topics(session: AsyncSession, user_id: int) -> set:
+    """Topics of the users followed by `user_id` when the stream starts"""
+    query = select(Social.to_id).where(Social.from_id == user_id)
+    return {f"user:{to_id}" for to_id in (await session.exec(query)).all()}
+
+
+async def thread_topics(session: AsyncSession, post_id: int) -> set:
+    query = select(Post.id, Post.date).where(Post.id == post_id)
+    if not await fetch_posts(session, query, [post_id]):
+        raise HTTPException(status_code=404, detail="Post not found")
+    return {f"thread:{post_id}"}
+
+
+async def next_post(
+    subscription: Subscription, follow_replies: bool = False
+) -> Optional[bytes]:
+    """The next post published to `subscription`, None once it is closed.
+
+    With `follow_replies` a reply also subscribes to the replies to it, so
+    the whole thread below the watched post is streamed.
+    """
+    message = await subscription.get()
+    if message is not None and follow_replies:
+        reply_id = orjson.loads(message)["id"]
+        broker.add_topics(subscription, [f"thread:{reply_id}"])
+    return message
+
+
+async def server_sent_events(
+    request: Request, subscription: Subscription, follow_replies: bool = False
+):
+    """Posts as `post` events, with a comment every `keepalive_seconds` to
+    notice disconnected clients"""
+    keepalive = settings.stream.keepalive_seconds
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    next_post(subscription, follow_replies), keepalive
+                )
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield b": keepalive\n\n"
+                continue
+            if message is None:
+                break
+            yield b"event: post\ndata: " + message + b"\n\n"
+    finally:
+        subscription.close()
+
+
+async def send_over_websocket(
+    websocket: WebSocket, subscription: Subscription, follow_replies: bool = False
+) -> None:
+    """Sends every post as a text message until either side closes"""
+
+    async def close_on_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        subscription.close()
+
+    watcher = asyncio.ensure_future(close_on_disconnect())
+    try:
+        while (message := await next_post(subscription, follow_replies)) is not None:
+            await websocket.send_text(message.decode())
+    finally:
+        disconnected = watcher.done()
+        watcher.cancel()
+        subscription.close()
+    if not disconnected:
+        await websocket.close()
+
+
+# The SSE routes look their topics up on a session of their own instead of
+# a session dependency, which FastAPI would only close once the stream ends
+@router.get("/feed/", response_class=StreamingResponse)
+async def stream_feed(*, user: User = AuthenticatedUser, request: Request):
+    """Server-sent events with the new posts of the users you follow"""
+    async with async_session_factory() as session:
+        topics = await feed_topics(session, user.id)
+    subscription = broker.subscribe(topics)
+    events = server_sent_events(request, subscription)
+    return StreamingResponse(events, media_type=SSE_MEDIA_TYPE)
+
+
+@router.get("/thread/{post_id}/", response_class=StreamingResponse)
+async def stream_thread(*, post_id: int, request: Request):
+    """Server-sent events with the new replies below a post"""
+    async with async_session_factory() as session:
+        topics = await thread_topics(session, post_id)
+    subscription = broker.subscribe(topics)
+    events = server_sent_events(request, subscription, follow_replies=True)
+    return StreamingResponse(events, media_type=SSE_MEDIA_TYPE)
+
+
+@router.websocket("/feed/ws/")
+async def stream_feed_websocket(websocket: WebSocket, token: str = ""):
+    """WebSocket with the new posts of the users you follow, browsers can
+    not set headers here so the access token goes in `?token=`"""
+    try:
+        user = await get_current_user(token=token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    async with async_session_factory() as session:
+        topics = await feed_topics(session, user.id)
+    await websocket.accept()
+    subscription = broker.subscribe(topics)
+    await send_over_websocket(websocket, subscription)
+
+
+@router.websocket("/thread/{post_id}/ws/")
+async def stream_thread_websocket(websocket: WebSocket, post_id: int):
+    """WebSocket with the new replies below a post"""
+    try:
+        async with async_session_factory() as session:
+            topics = await thread_topics(session, post_id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = broker.subscribe(topics)
+    await send_over_websocket(websocket, subscription, follow_replies=True)
@@ -1,49 +1,382 @@
-from typing import List
+from datetime import datetime
+from typing import Dict, List
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import Session, select
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from sqlalchemy import case, delete, literal, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from pamps.auth import AuthenticatedUser
-from pamps.db import ActiveSession
-from pamps.models.user import Social, User, UserRequest, UserResponse
+from pamps.auth import AuthenticatedUser, invalidate_cached_users
+from pamps.config import settings
+from pamps.db import AsyncActiveSession, AsyncReadSession, insert_or_ignore
+from pamps.graph import social_graph
+from pamps.models.user import (
+    BulkFollowRequest,
+    BulkFollowResponse,
+    FollowStatus,
+    Social,
+    User,
+    UserBatch,
+    UserRequest,
+    UserResponse,
+    UserSuggestion,
+)
+from pamps.pagination import Page, PageParams, keyset, paginate
+from pamps.response_cache import response_cache
+from pamps.security import async_get_password_hash
+from pamps.serialization import (
+    dumps,
+    encode_rows,
+    json_response,
+    response_columns,
+    row_dict,
+)
+from pamps.streaming import stream_ndjson, wants_ndjson
+from pamps.timeline import timeline_store
+from pamps.typeahead import prefix_index
 
 router = APIRouter()
 
+# Stable keyset order of every user listing
+USER_KEY = (User.id,)
+# List routes select these and encode the rows directly, see pamps.serialization
+USER_COLUMNS = response_columns(UserResponse, User)
+
+
+async def get_user_id(session: AsyncSession, username: str) -> int:
+    query = select(User.id).where(User.username == username)
+    user_id = (await session.exec(query)).first()
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+
+async def get_users_by_id(session: AsyncSession, ids: List[int]) -> Dict[int, dict]:
+    """UserResponse fields of the users with `ids` by id"""
+    if not ids:
+        return {}
+    query = select(*USER_COLUMNS, User.id).where(User.id.in_(ids))
+    names = tuple(UserResponse.__fields__)
+    return {
+        row.id: row_dict(names, row) for row in (await session.execute(query)).all()
+    }
+
+
+def follow_statement(session: AsyncSession, from_id: int, to_ids: List[int]):
+    """INSERT of the follows of `from_id` to the existing users in `to_ids`,
+    skipping the ones already there thanks to uq_social_from_id_to_id"""
+    followed = select(
+        literal(from_id), User.id, literal(datetime.utcnow(), Social.date.type)
+    ).where(User.id.in_(to_ids))
+    return insert_or_ignore(session, Social).from_select(
+        ["from_id", "to_id", "date"], followed
+    )
+
+
+async def invalidate_typeahead(session: AsyncSession, user_ids: List[int]) -> None:
+    """Drops the typeahead results holding the follower counts of `user_ids`"""
+    query = select(User.username).where(User.id.in_(user_ids))
+    prefix_index.invalidate(*(await session.exec(query)).all())
+
+
+async def update_follow_counts(
+    session: AsyncSession, from_id: int, to_id: int, delta: int
+) -> None:
+    """Moves the counters of a follow in the transaction of `session`"""
+    await session.execute(
+        update(User)
+        .where(User.id.in_((from_id, to_id)))
+        .values(
+            following_count=User.following_count
+            + case((User.id == from_id, delta), else_=0),
+            follower_count=User.follower_count
+            + case((User.id == to_id, delta), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def write_follows(
+    session: AsyncSession, from_id: int, to_ids: List[int], unfollow: bool
+) -> List[int]:
+    """Follows or unfollows `to_ids`, returns the ids of the rows actually
+    inserted or deleted"""
+    if unfollow:
+        statement = delete(Social).where(
+            Social.from_id == from_id, Social.to_id.in_(to_ids)
+        )
+    else:
+        statement = follow_statement(session, from_id, to_ids)
+    if session.bind.dialect.full_returning:
+        result = await session.execute(statement.returning(Social.to_id))
+        return list(result.scalars())
+    # without RETURNING, SQLite: the transaction fails if another writer
+    # commits between this read and the write
+    query = select(Social.to_id).where(
+        Social.from_id == from_id, Social.to_id.in_(to_ids)
+    )
+    followed = set((await session.exec(query)).all())
+    await session.execute(statement)
+    if unfollow:
+        return sorted(followed)
+    return [to_id for to_id in to_ids if to_id not in followed]
+
+
+async def update_bulk_follow_counts(
+    session: AsyncSession, from_id: int, to_ids: List[int], delta: int
+) -> None:
+    """Moves the counters of the follows of `from_id` to `to_ids`"""
+    await session.execute(
+        update(User)
+        .where(User.id.in_((from_id, *to_ids)))
+        .values(
+            following_count=User.following_count
+            + case((User.id == from_id, delta * len(to_ids)), else_=0),
+            follower_count=User.follower_count
+            + case((User.id == from_id, 0), else_=delta),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def followers_query(user_id: int, page: PageParams):
+    query = (
+        select(*USER_COLUMNS, Social.from_id)
+        .join(Social, Social.from_id == User.id)
+        .where(Social.to_id == user_id)
+    )
+    return keyset(query, (Social.from_id,), page)
+
+
+def following_query(user_id: int, page: PageParams):
+    query = (
+        select(*USER_COLUMNS, Social.to_id)
+        .join(Social, Social.to_id == User.id)
+        .where(Social.from_id == user_id)
+    )
+    return keyset(query, (Social.to_id,), page)
+
 
 @router.get("/", response_model=List[UserResponse])
-async def list_users(*, session: Session = ActiveSession):
+async def list_users(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    page: PageParams = Page,
+    request: Request,
+    response: Response,
+):
     """List all users"""
-    users = session.exec(select(User)).all()
-    return users
+    query = keyset(select(*USER_COLUMNS, User.id), USER_KEY, page)
+    if wants_ndjson(request):
+        return stream_ndjson(session, query, UserResponse)
+    users = (await session.execute(query)).all()
+    users = paginate(users, USER_KEY, page, response)
+    return json_response(encode_rows(users, UserResponse), response)
+
+
+@router.get("/batch/", response_model=UserBatch)
+async def get_users_by_username(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    response: Response,
+    usernames: List[str] = Query(...),
+):
+    """Users with the given usernames, in the order asked"""
+    if len(usernames) > settings.batch.max_keys:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.batch.max_keys} usernames are allowed",
+        )
+    usernames = list(dict.fromkeys(usernames))
+    query = select(*USER_COLUMNS).where(User.username.in_(usernames))
+    names = tuple(UserResponse.__fields__)
+    found = {
+        row.username: row_dict(names, row)
+        for row in (await session.execute(query)).all()
+    }
+    body = {
+        "items": [found[name] for name in usernames if name in found],
+        "missing": [name for name in usernames if name not in found],
+    }
+    return json_response(dumps(body), response)
+
+
+@router.get("/search/", response_model=List[UserResponse])
+async def search_users(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    response: Response,
+    prefix: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(10, ge=1, le=settings.typeahead.max_results),
+):
+    """Users whose username starts with prefix, for autocompletion"""
+    users = await prefix_index.search(session, prefix, limit)
+    return json_response(dumps(users), response)
 
 
 @router.get("/{username}/", response_model=UserResponse)
-async def get_user_by_username(*, session: Session = ActiveSession, username: str):
+async def get_user_by_username(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    username: str,
+    request: Request,
+    response: Response,
+):
     """Get user by username"""
+    if cached := await response_cache.lookup(request):
+        return cached
     query = select(User).where(User.username == username)
-    user = session.exec(query).first()
+    user = (await session.exec(query)).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    tags = {f"user:{username}", f"user:id:{user.id}"}
+    return await response_cache.store(request, response, UserResponse, user, tags)
+
+
+@router.get("/{username}/followers/", response_model=List[UserResponse])
+async def list_followers(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    username: str,
+    page: PageParams = Page,
+    response: Response,
+):
+    """List the users following username"""
+    user_id = await get_user_id(session, username)
+    key = (Social.from_id,)
+    users = (await session.execute(followers_query(user_id, page))).all()
+    users = paginate(users, key, page, response)
+    return json_response(encode_rows(users, UserResponse), response)
+
+
+@router.get("/{username}/following/", response_model=List[UserResponse])
+async def list_following(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    username: str,
+    page: PageParams = Page,
+    response: Response,
+):
+    """List the users username follows"""
+    user_id = await get_user_id(session, username)
+    key = (Social.to_id,)
+    users = (await session.execute(following_query(user_id, page))).all()
+    users = paginate(users, key, page, response)
+    return json_response(encode_rows(users, UserResponse), response)
+
+
+@router.get("/{username}/suggestions/", response_model=List[UserSuggestion])
+async def list_suggestions(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    username: str,
+    limit: int = Query(10, ge=1, le=settings.graph.max_suggestions),
+):
+    """Users followed by the users username follows, most shared first"""
+    user_id = await get_user_id(session, username)
+    await social_graph.ensure_loaded(session)
+    ranked = social_graph.suggestions(user_id, limit)
+    users = await get_users_by_id(session, [user_id for user_id, _ in ranked])
+    return [
+        {**users[user_id], "followed_by": count}
+        for user_id, count in ranked
+        if user_id in users
+    ]
+
+
+@router.get("/{username}/follow/", response_model=FollowStatus)
+async def get_follow_status(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    user: User = AuthenticatedUser,
+    username: str,
+):
+    """Whether you follow username, username follows you, or both"""
+    other_id = await get_user_id(session, username)
+    await social_graph.ensure_loaded(session)
+    following = social_graph.is_following(user.id, other_id)
+    followed_by = social_graph.is_following(other_id, user.id)
+    return FollowStatus(
+        following=following, followed_by=followed_by, mutual=following and followed_by
+    )
+
+
+@router.get("/{username}/known-followers/", response_model=List[UserResponse])
+async def list_known_followers(
+    *,
+    session: AsyncSession = AsyncReadSession,
+    user: User = AuthenticatedUser,
+    username: str,
+):
+    """Followers of username that you follow"""
+    other_id = await get_user_id(session, username)
+    await social_graph.ensure_loaded(session)
+    ids = social_graph.followed_by_followees(user.id, other_id)
+    users = await get_users_by_id(session, ids)
+    return [users[user_id] for user_id in ids if user_id in users]
 
 
 @router.post("/", response_model=None, status_code=201)
-async def create_user(*, session: Session = ActiveSession, user: UserRequest):
+async def create_user(*, session: AsyncSession = AsyncActiveSession, user: UserRequest):
     """Creates new user"""
-    db_user = User.from_orm(user)  # transform UserRequest in User
+    # hash on the worker pool so from_orm keeps the already hashed value
+    password = await async_get_password_hash(user.password)
+    db_user = User.from_orm(user, update={"password": password})
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    await response_cache.invalidate(f"user:{db_user.username}")
+    prefix_index.invalidate(db_user.username)
     return db_user
 
 
+@router.post("/follow/bulk/", response_model=BulkFollowResponse)
+async def bulk_follow_users(
+    *,
+    session: AsyncSession = AsyncActiveSession,
+    user: User = AuthenticatedUser,
+    request: BulkFollowRequest,
+):
+    """Follows or unfollows many users at once"""
+    if len(request.user_ids) > settings.follow.bulk_max:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.follow.bulk_max} user_ids are allowed",
+        )
+    ids = sorted({user_id for user_id in request.user_ids if user_id != user.id})
+    existing = (await session.exec(select(User.id).where(User.id.in_(ids)))).all()
+    ignored = sorted(set(request.user_ids) - set(existing))
+    if not existing:
+        return BulkFollowResponse(changed=0, ignored=ignored)
+
+    changed = await write_follows(session, user.id, existing, request.unfollow)
+    if changed:
+        delta = -1 if request.unfollow else 1
+        await update_bulk_follow_counts(session, user.id, changed, delta)
+    await session.commit()
+    invalidate_cached_users([user.id, *changed])
+    await invalidate_typeahead(session, [user.id, *changed])
+
+    for user_id in changed:
+        if request.unfollow:
+            social_graph.unfollow(user.id, user_id)
+        else:
+            social_graph.follow(user.id, user_id)
+    if changed:
+        timeline_store.drop(user.id)
+        await response_cache.invalidate(
+            *(f"user:id:{user_id}" for user_id in [user.id, *changed])
+        )
+    return BulkFollowResponse(changed=len(changed), ignored=ignored)
+
+
 @router.post(
     "/follow/{user_id}/",
     status_code=204,
 )
 async def follow_user(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     user: User = AuthenticatedUser,
     user_id: int,
 ) -> None:
@@ -51,21 +384,19 @@ async def follow_user(
     if user_id <= 0 or user_id == user.id:
         raise HTTPException(status_code=400, detail="Invalid user_id")
 
-    existing_user = session.get(User, user_id)
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    existing_relationship = (
-        session.query(Social)
-        .filter(Social.from_id == user.id, Social.to_id == user_id)
-        .first()
-    )
-    if existing_relationship:
+    result = await session.execute(follow_statement(session, user.id, [user_id]))
+    if not result.rowcount:
+        if not await session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
         return
 
-    new_relationship = Social(from_id=user.id, to_id=user_id)
-    session.add(new_relationship)
-    session.commit()
+    await update_follow_counts(session, user.id, user_id, 1)
+    await session.commit()
+    invalidate_cached_users([user.id, user_id])
+    await invalidate_typeahead(session, [user.id, user_id])
+    social_graph.follow(user.id, user_id)
+    timeline_store.drop(user.id)
+    await response_cache.invalidate(f"user:id:{user.id}", f"user:id:{user_id}")
     return
 
 
@@ -75,7 +406,7 @@ async def follow_user(
 )
 async def unfollow_user(
     *,
-    session: Session = ActiveSession,
+    session: AsyncSession = AsyncActiveSession,
     user: User = AuthenticatedUser,
     user_id: int,
 ) -> None:
@@ -83,18 +414,19 @@ async def unfollow_user(
     if user_id <= 0 or user_id == user.id:
         raise HTTPException(status_code=400, detail="Invalid user_id")
 
-    existing_user = session.get(User, user_id)
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    existing_relationship = (
-        session.query(Social)
-        .filter(Social.from_id == user.id, Social.to_id == user_id)
-        .first()
+    result = await session.execute(
+        delete(Social).where(Social.from_id == user.id, Social.to_id == user_id)
     )
-    if not existing_relationship:
+    if not result.rowcount:
+        if not await session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
         return None
 
-    session.delete(existing_relationship)
-    session.commit()
+    await update_follow_counts(session, user.id, user_id, -1)
+    await session.commit()
+    invalidate_cached_users([user.id, user_id])
+    await invalidate_typeahead(session, [user.id, user_id])
+    social_graph.unfollow(user.id, user_id)
+    timeline_store.drop(user.id)
+    await response_cache.invalidate(f"user:id:{user.id}", f"user:id:{user_id}")
     return None
@@ -0,0 +1,78 @@
+"""Full-text search over posts.
+
+Postgres matches `to_tsvector('english', text)` through the GIN index
+`ix_post_text_search`, SQLite matches the `post_fts` FTS5 table. Both are
+created with the `post` table, see `POST_SEARCH_DDL`.
+"""
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import Response
+from sqlalchemy import Float, Integer, column, func, literal_column, table
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps.models.post import Post
+from pamps.models.user import User
+from pamps.pagination import PageParams, keyset, paginate
+
+SEARCH_CONFIG = literal_column("'english'")
+
+post_fts = table("post_fts", column("rowid", Integer))
+
+
+def search_terms(q: str) -> List[str]:
+    """Words of a search query, every one of them must match"""
+    return re.findall(r"\w+", q.lower())
+
+
+def search_query(dialect: str, terms: List[str]):
+    """Posts matching all `terms` with their (score, post_id) key, a lower
+    score ranks higher"""
+    post_id = Post.id.label("post_id")
+    if dialect == "postgresql":
+        # the same expression as the index so the planner can use it
+        document = func.to_tsvector(SEARCH_CONFIG, Post.text)
+        tsquery = func.plainto_tsquery(SEARCH_CONFIG, " ".join(terms))
+        score = -func.ts_rank(document, tsquery, type_=Float)
+        return select(Post, score.label("score"), post_id).where(
+            document.op("@@")(tsquery)
+        )
+
+    match = " ".join('"%s"' % term for term in terms)
+    score = func.bm25(literal_column("post_fts"), type_=Float)
+    return (
+        select(Post, score.label("score"), post_id)
+        .join(post_fts, post_fts.c.rowid == Post.id)
+        .where(literal_column("post_fts").op("MATCH")(match))
+    )
+
+
+async def search_posts(
+    session: AsyncSession,
+    q: str,
+    page: PageParams,
+    response: Response,
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[Post]:
+    """Posts matching `q`, best ranked first and paginated by (score, id)"""
+    terms = search_terms(q)
+    if not terms:
+        return []
+    query = search_query(session.bind.dialect.name, terms)
+    if username is not None:
+        query = query.join(User, User.id == Post.user_id).where(
+            User.username == username
+        )
+    if since is not None:
+        query = query.where(Post.date >= since)
+    if until is not None:
+        query = query.where(Post.date < until)
+
+    key = (query.selected_columns.score, query.selected_columns.post_id)
+    rows = (await session.execute(keyset(query, key, page))).all()
+    rows = paginate(rows, key, page, response)
+    return [row.Post for row in rows]
@@ -1,6 +1,13 @@
 """Security utilities"""
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
+from pamps import metrics
 from pamps.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -19,6 +26,87 @@ def get_password_hash(password) -> str:
     return pwd_context.hash(password)
 
 
+class HashingPool:
+    """Runs bcrypt work off the event loop on a bounded worker pool.
+
+    At most `max_pending` calls may be running or queued at once, any call
+    above that is rejected with a 503 instead of waiting in line.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 4, max_pending: int = 32):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="pamps-hash"
+                )
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server busy, try again later",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queued": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hashing_pool = HashingPool(
+    kind=settings.security.hash_pool,
+    workers=settings.security.hash_workers,
+    max_pending=settings.security.hash_max_pending,
+)
+metrics.register("hashing_pool", hashing_pool.stats)
+
+
+async def async_verify_password(plain_password, hashed_password) -> bool:
+    """Verifies a hash against a password on the hashing pool"""
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def async_get_password_hash(password) -> "HashedPassword":
+    """Generates a hash from plain text on the hashing pool"""
+    return HashedPassword(await hashing_pool.run(get_password_hash, password))
+
+
 class HashedPassword(str):
     """Takes a plain text password and hashes it.
     use this as a field in your SQLModel
@@ -36,7 +124,10 @@ class HashedPassword(str):
 
     @classmethod
     def validate(cls, value):
-        """Accepts a plain text password and returns a hashed password."""
+        """Accepts a plain text password and returns a hashed password.
+        Values that are already a HashedPassword are kept as they are."""
+        if isinstance(value, cls):
+            return value
         if not isinstance(value, str):
             raise TypeError("String required!")
 
@@ -0,0 +1,51 @@
+"""Fast JSON path for list responses.
+
+Read routes select only the columns of their response model, labeled with
+the field names, and encode the row tuples with orjson. This skips building
+ORM objects, validating them into the response model and running
+`jsonable_encoder`, while producing the same bytes as `JSONResponse`.
+Fields holding other models, like the author of a post, have no column and
+are filled in by the caller, see `pamps.loaders`.
+"""
+from typing import Any, Iterable, List, Tuple, Type
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+from pydantic.utils import lenient_issubclass
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def column_fields(model: Type[BaseModel]) -> Tuple[str, ...]:
+    """Fields of `model` that do not hold other models, in field order"""
+    return tuple(
+        name
+        for name, field in model.__fields__.items()
+        if not lenient_issubclass(field.type_, BaseModel)
+    )
+
+
+def response_columns(model: Type[BaseModel], entity) -> List:
+    """Columns of `entity` for every column field of `model`, in field order"""
+    return [getattr(entity, name).label(name) for name in column_fields(model)]
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content)
+
+
+def row_dict(names: Tuple[str, ...], row) -> dict:
+    return dict(zip(names, row))
+
+
+def encode_rows(rows: Iterable, model: Type[BaseModel]) -> bytes:
+    """JSON array of `model` documents from rows that start with the
+    `response_columns` of `model`, columns after them are left out"""
+    names = column_fields(model)
+    return dumps([row_dict(names, row) for row in rows])
+
+
+def json_response(body: bytes, response: Response) -> Response:
+    """Response with an encoded body and the headers set on `response`"""
+    return Response(body, media_type=JSON_MEDIA_TYPE, headers=response.headers)
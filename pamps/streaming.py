@@ -0,0 +1,80 @@
+"""Streaming NDJSON responses.
+
+List endpoints answer `Accept: application/x-ndjson` with every row after
+the cursor, one JSON document per line. Rows are read through a server side
+cursor `streaming.yield_per` at a time and encoded as they arrive, so memory
+does not grow with the number of rows. Post authors are loaded once per
+batch of rows, by loaders that only live for that batch.
+"""
+from typing import Iterable, Type
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps.config import settings
+from pamps.db import async_session_factory
+from pamps.loaders import Loaders
+from pamps.serialization import column_fields, dumps, row_dict
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def accept_quality(accept: str, media_types: Iterable[str]) -> float:
+    """Highest q-value `accept` gives to any of `media_types`, 0 when none
+    of them is listed"""
+    best = 0.0
+    for media_range in accept.split(","):
+        media_type, *params = (part.strip() for part in media_range.split(";"))
+        if media_type.lower() not in media_types:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        best = max(best, quality)
+    return best
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Whether the client asked for NDJSON, with a q-value no lower than the
+    one it gives JSON. Wildcards only match JSON, the default."""
+    accept = request.headers.get("accept", "")
+    ndjson = accept_quality(accept, {NDJSON_MEDIA_TYPE})
+    default = accept_quality(accept, {"application/json", "application/*", "*/*"})
+    return ndjson > 0 and ndjson >= default
+
+
+def stream_ndjson(
+    session: AsyncSession, query, model: Type[BaseModel], authors: bool = False
+) -> StreamingResponse:
+    """Streams the rows of `query` as `model` documents, one per line.
+    `query` selects the `response_columns` of `model` first. `authors`
+    embeds the author of post documents.
+
+    The rows are read on a session of their own, bound to the same database
+    as `session`. The request session stays open until the body is sent,
+    FastAPI closes dependencies once the response ends, but this session
+    and its server side cursor are closed with the body, also when the
+    client goes away early.
+    """
+    names = column_fields(model)
+    query = query.limit(None).execution_options(yield_per=settings.streaming.yield_per)
+
+    async def lines():
+        async with async_session_factory(bind=session.bind) as stream_session:
+            result = await stream_session.stream(query)
+            async for rows in result.partitions():
+                documents = [row_dict(names, row) for row in rows]
+                if authors:
+                    # runs between two fetches of the cursor, not during one;
+                    # fresh loaders so the authors of past batches are freed
+                    await Loaders(stream_session).embed_authors(documents)
+                yield b"".join(dumps(document) + b"\n" for document in documents)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,62 @@
+"""Hashtag and mention index.
+
+`#tags` and `@usernames` are extracted from the text of a post when it is
+written and stored in the `hashtag` and `mention` tables, so finding the
+posts using them does not scan `Post.text`.
+"""
+import re
+from typing import Iterable, List, Set
+
+from sqlmodel import Session, select
+
+from pamps.db import insert_or_ignore
+from pamps.models.post import Hashtag, Mention, Post
+from pamps.models.user import User
+
+HASHTAG_RE = re.compile(r"(?<![\w#])#(\w+)")
+MENTION_RE = re.compile(r"(?<![\w@])@(\w+)")
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.lstrip("#").lower()
+
+
+def extract_hashtags(text: str) -> Set[str]:
+    return {normalize_tag(tag) for tag in HASHTAG_RE.findall(text)}
+
+
+def extract_mentions(text: str) -> Set[str]:
+    return set(MENTION_RE.findall(text))
+
+
+def index_posts(session: Session, posts: Iterable[Post]) -> None:
+    """Adds the hashtags and mentions of `posts` to the index.
+
+    Already indexed pairs are skipped so posts can be indexed again, and
+    mentions of unknown usernames are ignored. Call it through
+    `AsyncSession.run_sync` from async code.
+    """
+    hashtags: List[dict] = []
+    mentions = {}
+    for post in posts:
+        hashtags.extend(
+            {"post_id": post.id, "tag": tag} for tag in extract_hashtags(post.text)
+        )
+        mentions[post.id] = extract_mentions(post.text)
+
+    usernames = set().union(*mentions.values())
+    user_ids = {}
+    if usernames:
+        query = select(User.username, User.id).where(User.username.in_(usernames))
+        user_ids = dict(session.execute(query).all())
+    mentions = [
+        {"post_id": post_id, "user_id": user_ids[username]}
+        for post_id, names in mentions.items()
+        for username in names
+        if username in user_ids
+    ]
+
+    if hashtags:
+        session.execute(insert_or_ignore(session, Hashtag), hashtags)
+    if mentions:
+        session.execute(insert_or_ignore(session, Mention), mentions)
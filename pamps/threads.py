@@ -0,0 +1,105 @@
+"""Reply tree retrieval"""
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, literal
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps.models.post import Post
+from pamps.partitions import post_months
+
+
+def thread_query(
+    post_id: int,
+    max_depth: int,
+    conditions: list,
+    max_breadth: Optional[int] = None,
+):
+    """(post, depth) rows of a thread. The tree carries the post dates so the
+    posts are joined back on their full primary key, and replies are never
+    older than the post they answer.
+
+    With `max_breadth`, each step only follows the first replies of a post
+    by date, picked by a LIMIT subquery on the parent index. The subquery is
+    correlated to the reply, not to the tree: Postgres rejects a recursive
+    reference inside a subquery, and SQLite allows no window function in the
+    recursive part of a CTE.
+    """
+    tree = (
+        select(Post.id, Post.date, literal(0).label("depth"))
+        .where(Post.id == post_id, *conditions)
+        .cte("thread", recursive=True)
+    )
+    reply = aliased(Post)
+    filters = [
+        reply.parent_id == tree.c.id,
+        reply.date >= tree.c.date,
+        tree.c.depth < max_depth,
+    ]
+    if max_breadth is not None:
+        sibling = aliased(Post)
+        first_replies = (
+            select(sibling.id)
+            .where(sibling.parent_id == reply.parent_id)
+            .order_by(sibling.date, sibling.id)
+            .limit(max_breadth)
+        )
+        filters.append(reply.id.in_(first_replies))
+    tree = tree.union_all(
+        select(reply.id, reply.date, tree.c.depth + 1).where(*filters)
+    )
+    return select(Post, tree.c.depth).join(
+        tree, and_(Post.id == tree.c.id, Post.date == tree.c.date)
+    )
+
+
+async def fetch_thread(
+    session: AsyncSession,
+    post_id: int,
+    max_depth: int,
+    conditions: list,
+    max_breadth: Optional[int] = None,
+) -> list:
+    query = thread_query(post_id, max_depth, conditions, max_breadth)
+    return (await session.execute(query)).all()
+
+
+async def get_thread(
+    session: AsyncSession,
+    post_id: int,
+    max_depth: int,
+    max_breadth: Optional[int] = None,
+) -> Optional[dict]:
+    """Loads a post and its replies down to `max_depth` levels, and at most
+    `max_breadth` replies per post, in a single recursive query and nests
+    them. Replies are sorted by date as defined by `Post.__lt__`."""
+    conditions = post_months.conditions([post_id])
+    rows = await fetch_thread(session, post_id, max_depth, conditions, max_breadth)
+    if not rows and conditions:
+        # the root is dated out of order, look it up on every partition
+        post_months.retries += 1
+        rows = await fetch_thread(session, post_id, max_depth, [], max_breadth)
+
+    depths: Dict[int, int] = {}
+    children: Dict[int, List[Post]] = defaultdict(list)
+    root = None
+    for post, depth in rows:
+        depths[post.id] = depth
+        if post.id == post_id:
+            root = post
+        else:
+            children[post.parent_id].append(post)
+    if root is None:
+        return None
+
+    def nest(post: Post) -> dict:
+        replies = sorted(children[post.id])
+        return {
+            **post.dict(),
+            "depth": depths[post.id],
+            "replies": [nest(reply) for reply in replies],
+        }
+
+    return nest(root)
@@ -0,0 +1,238 @@
+"""Home timelines with hybrid fan-out.
+
+New posts are pushed to the timelines of the author's followers when the
+post is created (fan-out on write). Authors with more followers than
+`fanout_max_followers` are skipped and their posts are merged in when a
+timeline is read instead.
+
+Timelines are kept per process, so posts created by other workers are not
+pushed to them: every `sync_interval` seconds a read first merges in the
+posts newer than the newest one the timeline read from the database.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlmodel import or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps import metrics
+from pamps.cache import TTLCache
+from pamps.config import settings
+from pamps.models.post import Post
+from pamps.models.user import Social, User
+from pamps.pagination import PageParams, decode_cursor, keyset
+
+# (post date, post id), timelines keep them newest first
+Entry = Tuple[datetime, int]
+
+FEED_KEY = (Post.date, Post.id)
+
+
+class Timeline:
+    """Entries of one home timeline and how fresh they are"""
+
+    def __init__(self, entries: List[Entry], length: int):
+        self.entries = deque(entries, maxlen=length)
+        # newest entry read from the database, pushes do not move it
+        self.synced: Optional[Entry] = entries[0] if entries else None
+        self.synced_at = time.monotonic()
+
+
+class TimelineStore:
+    """In-process timelines of post keys, trimmed to `length` entries.
+
+    At most `max_timelines` recently read timelines are kept for `ttl`
+    seconds, a missing one is rebuilt from the database on its next read.
+    """
+
+    def __init__(
+        self,
+        length: int = 800,
+        fanout_max_followers: int = 10000,
+        max_timelines: int = 10000,
+        ttl: float = 3600,
+        sync_interval: float = 5,
+        sync_overlap: float = 5,
+    ):
+        self.length = length
+        self.fanout_max_followers = fanout_max_followers
+        self.sync_interval = sync_interval
+        # posts are dated before they commit, syncs re-read this many
+        # seconds below the newest entry so late commits are not skipped
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self.pushes = 0
+        self.rebuilds = 0
+        self.syncs = 0
+        self._timelines = TTLCache(max_size=max_timelines, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._timelines.get(user_id) is not None
+
+    def set(self, user_id: int, entries: Iterable[Entry]) -> None:
+        entries = sorted(entries, reverse=True)[: self.length]
+        self._timelines.set(user_id, Timeline(entries, self.length))
+        with self._lock:
+            self.rebuilds += 1
+
+    def push(self, user_ids: Iterable[int], entry: Entry) -> None:
+        """Prepends a new post to the loaded timelines of `user_ids`"""
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is not None:
+                    timeline.entries.appendleft(entry)
+                    self.pushes += 1
+
+    def sync_since(self, user_id: int) -> Optional[datetime]:
+        """Date from which a loaded timeline is due to re-read its posts,
+        None while it is fresh. A timeline without entries re-reads all."""
+        timeline = self._timelines.get(user_id)
+        if (
+            timeline is None
+            or time.monotonic() - timeline.synced_at < self.sync_interval
+        ):
+            return None
+        if timeline.synced is None:
+            return datetime.min
+        return timeline.synced[0] - self.sync_overlap
+
+    def merge(self, user_id: int, entries: Iterable[Entry]) -> None:
+        """Merges entries read from the database into a loaded timeline"""
+        entries = list(entries)
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return
+            merged = sorted({*timeline.entries, *entries}, reverse=True)
+            timeline.entries = deque(merged[: self.length], maxlen=self.length)
+            if entries:
+                newest = max(entries)
+                timeline.synced = max(newest, timeline.synced or newest)
+            timeline.synced_at = time.monotonic()
+            self.syncs += 1
+
+    def page(
+        self, user_id: int, before: Optional[Entry], limit: int
+    ) -> Optional[List[Entry]]:
+        """Up to `limit` entries older than `before`, None if not loaded"""
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return None
+            entries = iter(timeline.entries)
+            if before is not None:
+                entries = itertools.dropwhile(lambda entry: entry >= before, entries)
+            return list(itertools.islice(entries, limit))
+
+    def drop(self, user_id: int) -> None:
+        self._timelines.invalidate(user_id)
+
+    def clear(self) -> None:
+        self._timelines.clear()
+
+    def stats(self) -> dict:
+        return {
+            "timelines": len(self._timelines),
+            "evictions": self._timelines.evictions,
+            "pushes": self.pushes,
+            "rebuilds": self.rebuilds,
+            "syncs": self.syncs,
+        }
+
+
+timeline_store = TimelineStore(
+    length=settings.feed.timeline_length,
+    fanout_max_followers=settings.feed.fanout_max_followers,
+    max_timelines=settings.feed.max_timelines,
+    ttl=settings.feed.timeline_ttl,
+    sync_interval=settings.feed.sync_interval,
+)
+metrics.register("timelines", timeline_store.stats)
+
+
+async def fan_out(session: AsyncSession, post: Post) -> None:
+    """Pushes a new top level post to its author's and followers' timelines"""
+    if post.parent_id is not None:
+        return
+    followers = []
+    query = select(User.follower_count).where(User.id == post.user_id)
+    # the posts of celebrities are merged at read time, see `read_feed`
+    if (await session.exec(query)).one() <= timeline_store.fanout_max_followers:
+        query = select(Social.from_id).where(Social.to_id == post.user_id)
+        followers = (await session.exec(query)).all()
+    timeline_store.push([post.user_id, *followers], (post.date, post.id))
+
+
+def timeline_query(user_id: int, since: Optional[datetime] = None):
+    """Latest top level posts of the user and of everyone they follow,
+    dated after `since` when given"""
+    followees = select(Social.to_id).where(Social.from_id == user_id)
+    filters = [
+        or_(Post.user_id == user_id, Post.user_id.in_(followees)),
+        Post.parent_id == None,  # noqa: E711
+    ]
+    if since is not None and since > datetime.min:
+        filters.append(Post.date > since)
+    return (
+        select(Post.date, Post.id)
+        .where(*filters)
+        .order_by(Post.date.desc(), Post.id.desc())
+        .limit(timeline_store.length)
+    )
+
+
+async def build_timeline(
+    session: AsyncSession, user_id: int, since: Optional[datetime] = None
+) -> List[Entry]:
+    query = timeline_query(user_id, since)
+    return [tuple(row) for row in (await session.execute(query)).all()]
+
+
+async def read_feed(session: AsyncSession, user_id: int, page: PageParams) -> List:
+    """Posts of the home timeline of `user_id`, newest first.
+
+    Returns up to `page.limit + 1` posts so the caller can paginate.
+    """
+    before = decode_cursor(page.cursor, (datetime, int)) if page.cursor else None
+    entries = timeline_store.page(user_id, before, page.limit + 1)
+    if entries is None:
+        timeline_store.set(user_id, await build_timeline(session, user_id))
+        entries = timeline_store.page(user_id, before, page.limit + 1)
+    elif before is None and (since := timeline_store.sync_since(user_id)):
+        # posts other workers pushed to their own copy of the timeline
+        timeline_store.merge(user_id, await build_timeline(session, user_id, since))
+        entries = timeline_store.page(user_id, before, page.limit + 1)
+
+    # celebrities are decided from the shared follower counts, the same way
+    # `fan_out` skips them in every worker
+    followed = (
+        select(Social.to_id)
+        .join(User, User.id == Social.to_id)
+        .where(
+            Social.from_id == user_id,
+            User.follower_count > timeline_store.fanout_max_followers,
+        )
+    )
+    query = select(Post.date, Post.id).where(
+        Post.user_id.in_(followed), Post.parent_id == None  # noqa: E711
+    )
+    query = keyset(query, FEED_KEY, page, descending=True)
+    merged = [tuple(row) for row in (await session.execute(query)).all()]
+    if merged:
+        entries = sorted({*entries, *merged}, reverse=True)[: page.limit + 1]
+
+    if not entries:
+        return []
+    ids = [post_id for _, post_id in entries]
+    # the dates of the entries keep the lookup to the partitions of the page
+    dates = [date for date, _ in entries]
+    query = select(Post).where(
+        Post.id.in_(ids), Post.date >= min(dates), Post.date <= max(dates)
+    )
+    posts = {post.id: post for post in (await session.exec(query)).all()}
+    return [posts[post_id] for post_id in ids if post_id in posts]
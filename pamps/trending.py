@@ -0,0 +1,178 @@
+"""Trending posts leaderboard.
+
+Every like and direct reply adds `weight * 2 ** ((t - epoch) / half_life)`
+to the score of a recent top level post, so older engagement counts less
+without rescoring anything. A background job reads the `like_count` and
+`reply_count` of the recent top level posts, folds what changed since its
+last read into the scores and keeps the best `size` posts in memory for
+`GET /post/trending/`.
+
+The counters hold one like per (user, post), so liking a post again after
+unliking it only gives back what the unlike took, and they are updated in
+the transaction that writes the like or reply, so nothing committed late is
+missed. Engagement is scored at the time the job reads it.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlmodel import select
+
+from pamps import metrics
+from pamps.config import settings
+from pamps.db import async_session_factory
+from pamps.models.post import Post
+
+log = logging.getLogger(__name__)
+
+# Scores are rebased before the exponent can overflow a float
+MAX_EXPONENT = 512
+
+
+class Leaderboard:
+    def __init__(
+        self,
+        size: int = 100,
+        half_life: float = 6 * 3600,
+        window: float = 48 * 3600,
+        like_weight: float = 1,
+        reply_weight: float = 2,
+        refresh_interval: float = 30,
+    ):
+        self.size = size
+        self.half_life = half_life
+        self.window = window
+        self.like_weight = like_weight
+        self.reply_weight = reply_weight
+        self.refresh_interval = refresh_interval
+        self.epoch = time.time()
+        self.refreshes = 0
+        self.refreshed_at: Optional[float] = None
+        self._scores: Dict[int, float] = {}
+        self._dates: Dict[int, datetime] = {}
+        # (like_count, reply_count) of each post at the last refresh
+        self._counts: Dict[int, Tuple[int, int]] = {}
+        self._top: List[Post] = []
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, post_id: int, date: datetime, weight: float, at: float) -> None:
+        """Adds engagement with `weight` made at unix time `at`"""
+        if (at - self.epoch) / self.half_life > MAX_EXPONENT:
+            self._rebase(at)
+        boost = weight * 2 ** ((at - self.epoch) / self.half_life)
+        self._scores[post_id] = self._scores.get(post_id, 0) + boost
+        self._dates[post_id] = date
+
+    def _rebase(self, epoch: float) -> None:
+        factor = 2 ** ((self.epoch - epoch) / self.half_life)
+        self._scores = {key: score * factor for key, score in self._scores.items()}
+        self.epoch = epoch
+
+    def score(self, post_id: int, now: Optional[float] = None) -> float:
+        """Decayed score of a post at `now`"""
+        now = time.time() if now is None else now
+        return self._scores.get(post_id, 0) * 2 ** ((self.epoch - now) / self.half_life)
+
+    def prune(self, cutoff: datetime) -> None:
+        """Forgets posts published before `cutoff`"""
+        for post_id in [key for key, date in self._dates.items() if date < cutoff]:
+            del self._scores[post_id]
+            del self._dates[post_id]
+            self._counts.pop(post_id, None)
+
+    def ranking(self) -> List[int]:
+        scores = [item for item in self._scores.items() if item[1] > 0]
+        best = heapq.nlargest(self.size, scores, key=lambda i: i[1])
+        return [post_id for post_id, _ in best]
+
+    def top(self, limit: int) -> List[Post]:
+        return self._top[:limit]
+
+    async def refresh(self) -> None:
+        """Folds the likes and replies written since the last refresh"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            async with async_session_factory() as session:
+                await self._refresh(session)
+            self.refreshes += 1
+            self.refreshed_at = time.time()
+
+    def update(
+        self, post_id: int, date: datetime, likes: int, replies: int, at: float
+    ) -> None:
+        """Scores the change of the counters of a post since the last update,
+        an unlike or a deleted reply takes its weight back"""
+        seen_likes, seen_replies = self._counts.get(post_id, (0, 0))
+        weight = (likes - seen_likes) * self.like_weight
+        weight += (replies - seen_replies) * self.reply_weight
+        if weight:
+            self.add(post_id, date, weight, at)
+        self._counts[post_id] = (likes, replies)
+        self._dates[post_id] = date
+
+    async def _refresh(self, session) -> None:
+        now = time.time()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.window)
+        query = select(Post.id, Post.date, Post.like_count, Post.reply_count).where(
+            Post.parent_id == None,  # noqa: E711
+            Post.date >= cutoff,
+            or_(Post.like_count > 0, Post.reply_count > 0),
+        )
+        missing = set(self._counts)
+        for post_id, date, likes, replies in (await session.execute(query)).all():
+            missing.discard(post_id)
+            self.update(post_id, date, likes, replies, now)
+        # lost all their likes and replies since the last refresh
+        for post_id in missing:
+            self.update(post_id, self._dates[post_id], 0, 0, now)
+
+        self.prune(cutoff)
+        ids = self.ranking()
+        posts = {}
+        if ids:
+            # the known dates keep the lookup to the recent partitions
+            since = min(self._dates[post_id] for post_id in ids)
+            query = select(Post).where(Post.id.in_(ids), Post.date >= since)
+            posts = {post.id: post for post in (await session.exec(query)).all()}
+        self._top = [posts[post_id] for post_id in ids if post_id in posts]
+
+    async def run(self) -> None:
+        """Refreshes every `refresh_interval` seconds until cancelled"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception("Failed to refresh the trending posts")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "candidates": len(self._scores),
+            "refreshes": self.refreshes,
+        }
+
+
+trending = Leaderboard(
+    size=settings.trending.size,
+    half_life=settings.trending.half_life_hours * 3600,
+    window=settings.trending.window_hours * 3600,
+    like_weight=settings.trending.like_weight,
+    reply_weight=settings.trending.reply_weight,
+    refresh_interval=settings.trending.refresh_interval,
+)
+metrics.register("trending", trending.stats)
@@ -0,0 +1,125 @@
+"""Username typeahead.
+
+`GET /user/search/?prefix=` returns the first users by lowercased username
+(`User.username_key`) that start with a prefix, read from the
+`ix_user_username_prefix` range.
+Results are cached per prefix, sorted by key. When the cached results of
+a shorter prefix hold every user matching it, a longer prefix is answered
+from them by bisecting instead of querying, so the short prefixes typed
+first warm up the ones typed after them. Creating a user, or changing its
+follower counts, drops the cached prefixes of its username.
+"""
+import bisect
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pamps import metrics
+from pamps.cache import TTLCache
+from pamps.config import settings
+from pamps.models.user import User, UserResponse, username_key
+from pamps.serialization import response_columns, row_dict
+
+# sorts after every character a username can start with
+MAX_CHAR = "\U0010ffff"
+
+USER_COLUMNS = response_columns(UserResponse, User)
+
+
+class Matches(NamedTuple):
+    keys: List[str]
+    users: List[dict]
+    # True when every user matching the prefix is in `users`
+    complete: bool
+
+
+def prefix_bounds(prefix: str) -> Tuple[str, str]:
+    """[low, high) range of the username keys starting with `prefix`"""
+    prefix = username_key(prefix)
+    return prefix, prefix + MAX_CHAR
+
+
+def prefix_query(dialect: str, prefix: str, limit: int):
+    """(user columns..., key) of the first `limit` users matching `prefix`"""
+    key = User.username_key
+    if dialect == "postgresql":
+        # the same expression as the index so the planner can use it
+        key = key.collate("C")
+    low, high = prefix_bounds(prefix)
+    return (
+        select(*USER_COLUMNS, key.label("key"))
+        .where(key >= low, key < high)
+        .order_by(key)
+        .limit(limit)
+    )
+
+
+class PrefixIndex:
+    def __init__(self, max_results: int = 20, max_prefixes: int = 10000, ttl=60):
+        self.max_results = max_results
+        self.cache = TTLCache(max_size=max_prefixes, ttl=ttl)
+        self.queries = 0
+        self.narrowed = 0
+
+    def lookup(self, prefix: str) -> Optional[Matches]:
+        """Cached matches of `prefix`, or of a shorter prefix holding all of
+        its matches, narrowed down to `prefix`"""
+        prefix = username_key(prefix)
+        matches = self.cache.get(prefix)
+        if matches is not None:
+            return matches
+        for size in range(len(prefix) - 1, 0, -1):
+            shorter = self.cache.get(prefix[:size])
+            if shorter is not None and shorter.complete:
+                low, high = prefix_bounds(prefix)
+                start = bisect.bisect_left(shorter.keys, low)
+                end = bisect.bisect_left(shorter.keys, high)
+                matches = Matches(
+                    shorter.keys[start:end], shorter.users[start:end], True
+                )
+                self.cache.set(prefix, matches)
+                self.narrowed += 1
+                return matches
+        return None
+
+    async def search(self, session: AsyncSession, prefix: str, limit: int) -> List:
+        matches = self.lookup(prefix)
+        if matches is None:
+            query = prefix_query(
+                session.bind.dialect.name, prefix, self.max_results + 1
+            )
+            rows = (await session.execute(query)).all()
+            self.queries += 1
+            complete = len(rows) <= self.max_results
+            rows = rows[: self.max_results]
+            names = tuple(UserResponse.__fields__)
+            matches = Matches(
+                [row.key for row in rows],
+                [row_dict(names, row) for row in rows],
+                complete,
+            )
+            self.cache.set(username_key(prefix), matches)
+        return matches.users[:limit]
+
+    def invalidate(self, *usernames: str) -> None:
+        """Drops the cached prefixes `usernames` match"""
+        for username in usernames:
+            key = username_key(username)
+            for size in range(1, len(key) + 1):
+                self.cache.invalidate(key[:size])
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "queries": self.queries,
+            "narrowed": self.narrowed,
+        }
+
+
+prefix_index = PrefixIndex(
+    max_results=settings.typeahead.max_results,
+    max_prefixes=settings.typeahead.max_prefixes,
+    ttl=settings.typeahead.ttl,
+)
+metrics.register("typeahead", prefix_index.stats)
@@ -0,0 +1,67 @@
+"""Compares the two ways list routes can build a JSON body.
+
+    pip install -e . && python scripts/bench_serialization.py --rows 100
+
+"model" loads ORM objects, validates them into the response model and
+encodes them with JSONResponse. "fast" selects the response columns and
+encodes the row tuples with orjson, see pamps.serialization.
+"""
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from pamps.models import Post
+from pamps.models.post import PostResponse
+from pamps.serialization import column_fields, dumps, response_columns, row_dict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    start = datetime(2026, 1, 1)
+    with Session(engine) as session:
+        session.add_all(
+            Post(text=f"post number {n} " * 5, user_id=1, date=start + timedelta(n))
+            for n in range(args.rows)
+        )
+        session.commit()
+
+    def model_path():
+        with Session(engine) as session:
+            posts = session.exec(select(Post)).all()
+            return JSONResponse(
+                jsonable_encoder(parse_obj_as(List[PostResponse], posts))
+            ).body
+
+    def fast_path():
+        with Session(engine) as session:
+            query = select(*response_columns(PostResponse, Post))
+            names = column_fields(PostResponse)
+            # there are no users here, so every post has no author
+            return dumps(
+                [
+                    {**row_dict(names, row), "author": None}
+                    for row in session.execute(query).all()
+                ]
+            )
+
+    assert model_path() == fast_path()
+    for name, path in (("model", model_path), ("fast", fast_path)):
+        seconds = min(timeit.repeat(path, number=args.repeat, repeat=3))
+        per_call = seconds / args.repeat * 1000
+        print(f"{name:>5}: {per_call:8.3f} ms per {args.rows} rows")
+
+
+if __name__ == "__main__":
+    main()
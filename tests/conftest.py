@@ -8,7 +8,10 @@ from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session
 from typer.testing import CliRunner
 
-from pamps.db import engine
+# Likes are written before each request returns so tests can assert on them
+os.environ.setdefault("PAMPS_LIKES__MODE", "sync")  # noqa
+
+from pamps.db import engine  # noqa
 
 # This next line ensures tests uses its own database and settings environment
 os.environ["FORCE_ENV_FOR_DYNACONF"] = "testing"  # noqa
@@ -1,8 +1,13 @@
 import json
 
 import pytest
+from sqlalchemy import update
+from sqlmodel import Session, select
 
-from pamps.models import Like, Social
+from pamps.db import engine
+from pamps.models import Like, Post, Social, User
+
+from .conftest import create_api_client_authenticated
 
 
 @pytest.mark.order(1)
@@ -311,3 +316,114 @@ def test_try_to_dislike_non_existent_liked_post_and_get_404(session, api_client_
 
     assert response.status_code == 404
     assert result["detail"] == "Like not found"
+
+
+def test_liking_twice_keeps_a_single_like(session, api_client_user_2):
+    for _ in range(2):
+        response = api_client_user_2.post("/post/2/like")
+        assert response.status_code == 201
+        assert response.json()["like_count"] == 1
+
+    likes = session.query(Like).filter(Like.user_id == 2, Like.post_id == 2).count()
+    assert likes == 1
+
+
+def test_post_exposes_like_and_reply_counts(api_client):
+    result = api_client.get("/post/1/").json()
+    assert result["like_count"] == 1
+    assert result["reply_count"] == 2
+
+
+def test_follows_are_counted_and_listed(api_client_user_1, api_client_user_2):
+    def counts():
+        one = api_client_user_1.get("/user/user_1/").json()
+        two = api_client_user_1.get("/user/user_2/").json()
+        return one["following_count"], two["follower_count"]
+
+    api_client_user_1.delete("/user/follow/2/")
+    following, followers = counts()
+
+    for _ in range(2):
+        assert api_client_user_1.post("/user/follow/2/").status_code == 204
+    assert counts() == (following + 1, followers + 1)
+    listed = api_client_user_1.get("/user/user_2/followers/").json()
+    assert "user_1" in [user["username"] for user in listed]
+    listed = api_client_user_1.get("/user/user_1/following/").json()
+    assert "user_2" in [user["username"] for user in listed]
+
+    for _ in range(2):
+        assert api_client_user_1.delete("/user/follow/2/").status_code == 204
+    assert counts() == (following, followers)
+    assert api_client_user_1.get("/user/nobody/followers/").status_code == 404
+
+
+def test_bulk_follow_and_unfollow(api_client_user_1):
+    for name, user_id in [("bulk_a", 71), ("bulk_b", 72)]:
+        create_api_client_authenticated(name, user_id)
+    api_client_user_1.post("/user/follow/71/")
+
+    response = api_client_user_1.post(
+        "/user/follow/bulk/", json={"user_ids": [71, 72, 72, 1, 999]}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"changed": 1, "ignored": [1, 999]}
+    following = api_client_user_1.get("/user/user_1/following/").json()
+    assert {"bulk_a", "bulk_b"} <= {user["username"] for user in following}
+    assert api_client_user_1.get("/user/bulk_b/").json()["follower_count"] == 1
+    # the follow that already existed is not counted again
+    assert api_client_user_1.get("/user/bulk_a/").json()["follower_count"] == 1
+
+    response = api_client_user_1.post(
+        "/user/follow/bulk/", json={"user_ids": [71, 72], "unfollow": True}
+    )
+    assert response.json() == {"changed": 2, "ignored": []}
+    assert api_client_user_1.get("/user/bulk_a/").json()["follower_count"] == 0
+    response = api_client_user_1.post(
+        "/user/follow/bulk/", json={"user_ids": list(range(1, 1002))}
+    )
+    assert response.status_code == 400
+
+
+def test_batch_lookups_report_missing_keys(api_client_user_1, api_client_user_2):
+    response = api_client_user_1.get(
+        "/user/batch/", params={"usernames": ["user_2", "nobody", "user_1", "user_2"]}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [user["username"] for user in body["items"]] == ["user_2", "user_1"]
+    assert body["missing"] == ["nobody"]
+
+    post_id = api_client_user_1.post("/post/", json={"text": "batch"}).json()["id"]
+    response = api_client_user_1.get("/post/batch/", params={"ids": [0, post_id]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["missing"] == [0]
+    post = api_client_user_1.get(f"/post/{post_id}/").json()
+    del post["replies"]
+    assert body["items"] == [post]
+
+    too_many = {"ids": list(range(101))}
+    assert api_client_user_1.get("/post/batch/", params=too_many).status_code == 400
+    assert api_client_user_1.get("/user/batch/").status_code == 422
+
+
+def test_backfill_counts_recomputes_counters(cli, cli_client):
+    with Session(engine) as session:
+        expected = counters(session)
+        session.execute(update(Post).values(like_count=0, reply_count=0))
+        session.execute(update(User).values(follower_count=0, following_count=0))
+        session.commit()
+
+    result = cli_client.invoke(cli, ["backfill-counts", "--batch-size", "2"])
+    assert result.exit_code == 0
+    with Session(engine) as session:
+        assert counters(session) == expected
+
+
+def counters(session):
+    posts = session.exec(select(Post)).all()
+    users = session.exec(select(User)).all()
+    return (
+        {post.id: (post.like_count, post.reply_count) for post in posts},
+        {user.id: (user.follower_count, user.following_count) for user in users},
+    )
@@ -0,0 +1,53 @@
+import time
+
+from pamps.auth import user_cache
+from pamps.cache import TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_respects_explicit_expiry():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1, expires_at=time.time() - 1)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_reports_evicted_and_expired_keys():
+    evicted = []
+    cache = TTLCache(max_size=1, ttl=60, on_evict=lambda *item: evicted.append(item))
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=time.time() - 1)
+    assert cache.get("b") is None
+    assert evicted == [("a", 1), ("b", 2)]
+
+
+def test_authenticated_requests_hit_the_user_cache(api_client_user_1):
+    user_cache.clear()
+    hits = user_cache.hits
+    for _ in range(3):
+        response = api_client_user_1.post("/post/", json={"text": "cached"})
+        assert response.status_code == 201
+
+    assert user_cache.hits - hits == 2
+    metrics = api_client_user_1.get("/metrics/").json()
+    assert metrics["user_cache"]["hits"] == user_cache.hits
+
+
+def test_follow_counters_drop_cached_users(api_client_user_1, api_client_user_2):
+    user_cache.clear()
+    api_client_user_1.delete("/user/follow/2/")  # authenticating caches user_1
+    assert user_cache.get("user_1") is not None
+    api_client_user_1.post("/user/follow/2/")
+    assert user_cache.get("user_1") is None
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
+
+from pamps import db
+from pamps.db import PoolMetrics, ReplicaSet, get_async_url
+
+
+def test_async_url_swaps_the_driver():
+    assert get_async_url("sqlite:///testing.db").drivername == "sqlite+aiosqlite"
+    url = get_async_url("postgresql://postgres:postgres@db:5432/pamps")
+    assert url.drivername == "postgresql+asyncpg"
+    assert url.password == "postgres"
+
+
+def test_pool_metrics_count_checkouts_and_timeouts():
+    pool_metrics = PoolMetrics()
+    engine = create_engine(
+        "sqlite://",
+        poolclass=pool_metrics.pool_class(QueuePool),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+    pool_metrics.instrument(engine)
+
+    with engine.connect():
+        assert pool_metrics.stats()["checked_out"] == 1
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+    stats = pool_metrics.stats()
+    assert stats["checked_out"] == 0
+    assert stats["checkouts"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["size"] == 1
+    assert stats["pool"] == "QueuePool"
+
+    # a disposed engine gets a new pool, still instrumented
+    engine.dispose()
+    with engine.connect():
+        assert pool_metrics.stats()["checked_out"] == 1
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    assert pool_metrics.stats()["timeouts"] == 2
+
+
+def test_replica_set_round_robins_over_healthy_replicas():
+    first, second = object(), object()
+    replica_set = ReplicaSet([first, second], retry_after=60)
+    assert replica_set.healthy() == [first, second]
+    assert replica_set.healthy() == [second, first]
+
+    replica_set.mark_down(first)
+    assert replica_set.healthy() == [second]
+    stats = {"replicas": 2, "healthy": 1, "failures": 1, "probes": 0}
+    assert replica_set.stats() == stats
+
+
+def test_reads_fall_back_to_primary_when_replica_is_down(monkeypatch, api_client):
+    broken = create_async_engine("sqlite+aiosqlite:////nonexistent/pamps.db")
+    replica_set = ReplicaSet([broken], retry_after=60)
+    monkeypatch.setattr(db, "replica_set", replica_set)
+
+    asyncio.run(replica_set.probe())
+    assert replica_set.stats()["failures"] == 1
+
+    response = api_client.get("/user/")
+    assert response.status_code == 200
+    assert replica_set.stats()["failures"] == 1
+
+
+def test_probe_readmits_recovered_replicas():
+    replica = create_async_engine(db.async_url)
+    replica_set = ReplicaSet([replica], retry_after=60)
+    replica_set.mark_down(replica)
+    assert replica_set.healthy() == []
+
+    asyncio.run(replica_set.probe())
+    assert replica_set.healthy() == [replica]
+    assert replica_set.stats()["probes"] == 1
+
+
+def test_writers_are_pinned_to_primary(monkeypatch, api_client_user_1):
+    replica_set = ReplicaSet([object()], retry_after=60)
+    monkeypatch.setattr(db, "replica_set", replica_set)
+    db.write_pins.clear()
+
+    response = api_client_user_1.post("/post/", json={"text": "pinned"})
+    assert response.status_code == 201
+    assert db.write_pins.get("user_1")
+
+    response = api_client_user_1.get("/post/")
+    assert response.status_code == 200
+
+
+def test_buffered_likes_pin_the_liker_to_primary(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "pin"}).json()["id"]
+    db.write_pins.clear()
+
+    response = api_client_user_1.post(f"/post/{post_id}/like/")
+    assert response.status_code == 201
+    assert db.write_pins.get("user_1")
@@ -0,0 +1,88 @@
+from sqlmodel import Session
+
+from pamps.db import engine
+from pamps.models.post import Post
+from pamps.pagination import NEXT_CURSOR_HEADER
+from pamps.timeline import TimelineStore, timeline_store
+
+
+def create_posts(client, prefix, count):
+    return [
+        client.post("/post/", json={"text": f"{prefix} {n}"}).json()["id"]
+        for n in range(count)
+    ]
+
+
+def test_feed_has_own_and_followed_posts_newest_first(
+    api_client_user_1, api_client_user_2
+):
+    api_client_user_1.post("/user/follow/2/")
+    api_client_user_1.get("/post/feed/")  # loads the timeline
+    own = create_posts(api_client_user_1, "own", 1)
+    pushed = create_posts(api_client_user_2, "pushed", 2)
+
+    response = api_client_user_1.get("/post/feed/")
+    assert response.status_code == 200
+    feed = [post["id"] for post in response.json()]
+    assert feed[:3] == [pushed[1], pushed[0], own[0]]
+    assert timeline_store.stats()["pushes"] >= 3
+
+
+def test_feed_pages_do_not_overlap(api_client_user_1, api_client_user_2):
+    api_client_user_1.post("/user/follow/2/")
+    create_posts(api_client_user_2, "paged", 3)
+
+    seen, params = [], {"limit": 2}
+    while True:
+        response = api_client_user_1.get("/post/feed/", params=params)
+        seen.extend((post["date"], post["id"]) for post in response.json())
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
+
+    assert seen == sorted(set(seen), reverse=True)
+    assert len(seen) >= 3
+
+
+def test_celebrity_posts_are_merged_at_read_time(
+    monkeypatch, api_client_user_1, api_client_user_2
+):
+    monkeypatch.setattr(timeline_store, "fanout_max_followers", 0)
+    timeline_store.clear()
+    api_client_user_1.post("/user/follow/2/")
+    api_client_user_1.get("/post/feed/")
+    pushes = timeline_store.pushes
+
+    post_id = create_posts(api_client_user_2, "celebrity", 1)[0]
+    assert timeline_store.pushes == pushes  # not pushed to user_1
+
+    feed = api_client_user_1.get("/post/feed/").json()
+    assert feed[0]["id"] == post_id
+    timeline_store.clear()
+
+
+def test_posts_of_other_workers_are_merged_on_sync(
+    monkeypatch, api_client_user_1, api_client_user_2
+):
+    api_client_user_1.post("/user/follow/2/")
+    timeline_store.drop(1)
+    api_client_user_1.get("/post/feed/")
+    # created without this worker's fan-out
+    with Session(engine) as session:
+        post = Post(text="elsewhere", user_id=2)
+        session.add(post)
+        session.commit()
+        post_id = post.id
+
+    assert api_client_user_1.get("/post/feed/").json()[0]["id"] != post_id
+    monkeypatch.setattr(timeline_store, "sync_interval", 0)
+    assert api_client_user_1.get("/post/feed/").json()[0]["id"] == post_id
+
+
+def test_timelines_are_bounded():
+    store = TimelineStore(max_timelines=2)
+    for user_id in (1, 2, 3):
+        store.set(user_id, [])
+    assert 1 not in store and 3 in store
+    assert store.stats()["timelines"] == 2
+    assert store.stats()["evictions"] == 1
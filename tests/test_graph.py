@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from pamps.graph import Adjacency, SocialGraph
+
+from .conftest import create_api_client_authenticated
+
+EDGES = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (2, 1), (4, 1), (6, 4)]
+
+
+@pytest.fixture
+def social():
+    social = SocialGraph(compact_after=3)
+    social.build(EDGES)
+    return social
+
+
+def test_adjacency_is_sorted_csr():
+    adjacency = Adjacency(EDGES)
+    assert adjacency.neighbours(1) == [2, 3]
+    assert adjacency.neighbours(5) == adjacency.neighbours(100) == []
+    assert adjacency.has(3, 5) and not adjacency.has(5, 3)
+    assert sorted(adjacency.edges()) == sorted(EDGES)
+    assert len(adjacency) == len(EDGES)
+
+
+def test_suggestions_rank_by_shared_followees(social):
+    # 2 and 3 both follow 4, only 3 follows 5, 1 is the user itself
+    assert social.suggestions(1, 10) == [(4, 2), (5, 1)]
+    assert social.suggestions(1, 1) == [(4, 2)]
+    assert social.suggestions(5, 10) == []
+
+
+def test_mutual_and_followed_by_followees(social):
+    assert social.is_mutual(1, 2) and not social.is_mutual(1, 3)
+    assert social.followed_by_followees(1, 4) == [2, 3]
+    assert social.followed_by_followees(6, 1) == [4]
+
+
+def test_changes_apply_before_and_after_compaction(social):
+    async def change():
+        social.follow(1, 4)
+        social.unfollow(3, 5)
+        assert social.suggestions(1, 10) == []
+        assert social.is_following(1, 4) and not social.is_following(3, 5)
+        assert social.followers.neighbours(4) == [1, 2, 3, 6]
+        assert social._task is None
+
+        social.follow(5, 6)  # third change compacts in the background
+        await asyncio.sleep(0)  # the compaction copies the changes
+        social.follow(6, 1)  # made while compacting, replayed on the result
+        assert social.is_following(6, 1)
+        await social._task
+
+    asyncio.run(change())
+    assert social.compactions == 1
+    assert social.following.changes == 1
+    assert social.following.neighbours(1) == [2, 3, 4]
+    assert social.following.neighbours(6) == [1, 4]
+    assert social.followers.neighbours(6) == [5]
+    assert len(social.following) == len(EDGES) + 2
+
+
+def test_suggestions_api(api_client):
+    clients = {
+        name: create_api_client_authenticated(name, user_id)
+        for name, user_id in [("graph_a", 61), ("graph_b", 62), ("graph_c", 63)]
+    }
+    clients["graph_a"].post("/user/follow/62/")
+    clients["graph_b"].post("/user/follow/63/")
+    clients["graph_c"].post("/user/follow/62/")
+
+    response = api_client.get("/user/graph_a/suggestions/", params={"limit": 5})
+    assert response.status_code == 200
+    assert [(user["username"], user["followed_by"]) for user in response.json()] == [
+        ("graph_c", 1)
+    ]
+    assert api_client.get("/user/nobody/suggestions/").status_code == 404
+
+    status = clients["graph_b"].get("/user/graph_c/follow/").json()
+    assert status == {"following": True, "followed_by": True, "mutual": True}
+    known = clients["graph_a"].get("/user/graph_c/known-followers/").json()
+    assert [user["username"] for user in known] == ["graph_b"]
+
+    clients["graph_a"].delete("/user/follow/62/")
+    assert api_client.get("/user/graph_a/suggestions/").json() == []
+
+
+def test_changes_made_during_the_first_load_survive_compaction():
+    social = SocialGraph(compact_after=1)
+
+    class Rows:
+        def all(self):
+            return [(1, 2)]
+
+    class SlowSession:
+        async def execute(self, query):
+            social.follow(7, 8)  # enough changes to compact
+            await asyncio.sleep(0)
+            social.follow(8, 9)
+            return Rows()
+
+    async def load():
+        await social.load(SlowSession())
+        if social._task is not None:
+            await social._task
+
+    asyncio.run(load())
+    assert social.following.neighbours(1) == [2]
+    assert social.following.neighbours(7) == [8]
+    assert social.following.neighbours(8) == [9]
+    assert social.followers.neighbours(9) == [8]
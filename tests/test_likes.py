@@ -0,0 +1,117 @@
+import asyncio
+
+from sqlmodel import Session, func, select
+
+from pamps.db import engine
+from pamps.likes import LikeBuffer
+from pamps.models.post import Like, Post
+
+
+def count_likes(post_id):
+    with Session(engine) as session:
+        query = select(func.count(Like.id)).where(Like.post_id == post_id)
+        return session.exec(query).one(), session.get(Post, post_id).like_count
+
+
+def test_buffered_toggles_are_coalesced_into_one_write(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "toggled"}).json()["id"]
+    buffer = LikeBuffer(mode="buffered", max_pending=100)
+
+    async def toggle():
+        assert not await buffer.like(2, post_id)
+        assert not await buffer.unlike(2, post_id)
+        assert not await buffer.like(2, post_id)
+        assert not await buffer.like(1, post_id)
+        assert buffer.state(2, post_id) is True
+        assert count_likes(post_id) == (0, 0)
+        await buffer.flush()
+
+    asyncio.run(toggle())
+    assert count_likes(post_id) == (2, 2)
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["coalesced"] == 2
+    assert buffer.stats()["flushes"] == 1
+
+
+def test_buffer_is_flushed_when_full(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "full"}).json()["id"]
+    buffer = LikeBuffer(mode="buffered", max_pending=2)
+
+    async def fill():
+        assert not await buffer.like(1, post_id)
+        assert await buffer.like(2, post_id)
+        assert await buffer.unlike(1, post_id) is False
+
+    asyncio.run(fill())
+    assert count_likes(post_id) == (2, 2)
+    asyncio.run(buffer.stop())
+    assert count_likes(post_id) == (1, 1)
+
+
+def test_stop_keeps_a_batch_cancelled_mid_write(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "cut"}).json()["id"]
+
+    class SlowBuffer(LikeBuffer):
+        writing = None
+
+        async def _write(self, batch):
+            if not self.writing.is_set():
+                self.writing.set()
+                await asyncio.sleep(3600)
+            await super()._write(batch)
+
+    buffer = SlowBuffer(mode="buffered", flush_interval=0)
+
+    async def cut():
+        buffer.writing = asyncio.Event()
+        buffer.start()
+        await buffer.like(2, post_id)
+        await buffer.writing.wait()
+        # the batch being written is still visible to dislikes
+        assert buffer.state(2, post_id) is True
+        assert buffer.stats()["pending"] == 0
+        await buffer.stop()
+
+    asyncio.run(cut())
+    assert count_likes(post_id) == (1, 1)
+    assert buffer.state(2, post_id) is None
+
+
+def test_like_count_moves_by_the_rows_written(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "delta"}).json()["id"]
+    buffer = LikeBuffer(mode="sync")
+
+    async def write():
+        await buffer.like(1, post_id)
+        # already written, neither counts again
+        await buffer.like(1, post_id)
+        await buffer.unlike(2, post_id)
+
+    asyncio.run(write())
+    assert count_likes(post_id) == (1, 1)
+
+
+def test_a_failing_pair_is_written_alone_then_dropped(api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "bad"}).json()["id"]
+
+    class FailingBuffer(LikeBuffer):
+        async def _write(self, batch):
+            if (1, -1) in batch:
+                raise RuntimeError("bad pair")
+            await super()._write(batch)
+
+    buffer = FailingBuffer(mode="buffered", max_attempts=2)
+
+    async def write():
+        await buffer.like(1, -1)
+        await buffer.like(2, post_id)
+        await buffer.flush()
+        # the other pair is written, the bad one waits for another attempt
+        assert count_likes(post_id) == (1, 1)
+        assert buffer.state(1, -1) is True
+        await buffer.flush()
+
+    asyncio.run(write())
+    assert buffer.state(1, -1) is None
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["dropped"] == 1
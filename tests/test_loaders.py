@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from pamps.loaders import DataLoader
+
+
+def test_loads_of_one_iteration_are_batched_and_cached():
+    batches = []
+
+    async def batch_load(keys):
+        batches.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    async def main():
+        loader = DataLoader(batch_load)
+        loader.prime(4, 400)
+        first = await asyncio.gather(loader.load(1), loader.load(2), loader.load(1))
+        second = await loader.load_many([2, 3, 4])
+        return first, second
+
+    assert asyncio.run(main()) == ([10, 20, 10], [20, None, 400])
+    assert batches == [[1, 2], [3]]
+
+
+@pytest.mark.parametrize("iterations", [1, 2], ids=["before-start", "mid-batch"])
+def test_cancelled_batches_do_not_leave_loads_hanging(iterations):
+    async def batch_load(keys):
+        await asyncio.sleep(3600)
+
+    async def main():
+        loader = DataLoader(batch_load)
+        future = loader.load(1)
+        for _ in range(iterations):
+            await asyncio.sleep(0)
+        (task,) = loader._tasks
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await future
+        assert not loader._tasks
+        assert loader.load(1) is not future
+
+    asyncio.run(main())
+
+
+def test_failed_batches_are_not_cached():
+    calls = []
+
+    async def batch_load(keys):
+        calls.append(keys)
+        if len(calls) == 1:
+            raise RuntimeError("down")
+        return {key: key for key in keys}
+
+    async def main():
+        loader = DataLoader(batch_load)
+        with pytest.raises(RuntimeError):
+            await loader.load(1)
+        return await loader.load(1)
+
+    assert asyncio.run(main()) == 1
+
+
+def test_posts_embed_their_authors(api_client_user_1, api_client_user_2):
+    parent = api_client_user_1.post("/post/", json={"text": "loaded"}).json()
+    assert parent["author"] == {"username": "user_1", "avatar": None}
+    api_client_user_2.post("/post/", json={"text": "re", "parent_id": parent["id"]})
+
+    post = api_client_user_1.get(f"/post/{parent['id']}/").json()
+    assert post["author"]["username"] == "user_1"
+    assert [reply["author"]["username"] for reply in post["replies"]] == ["user_2"]
+    thread = api_client_user_1.get(f"/post/{parent['id']}/thread/").json()
+    assert thread["replies"][0]["author"]["username"] == "user_2"
+
+    api_client_user_2.post(f"/post/{parent['id']}/like/")
+    liked = api_client_user_1.get("/post/likes/user_2/", params={"limit": 100}).json()
+    assert {post["author"]["username"] for post in liked} == {"user_1"}
+    posts = api_client_user_1.get("/post/", params={"limit": 100}).json()
+    assert all(post["author"]["username"] for post in posts)
+
+    lines = api_client_user_1.get(
+        "/post/user/user_1/", headers={"Accept": "application/x-ndjson"}
+    ).content.splitlines()
+    assert {json.loads(line)["author"]["username"] for line in lines} == {"user_1"}
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from sqlmodel import select
+
+from pamps.models import Post
+from pamps.pagination import NEXT_CURSOR_HEADER, PageParams, encode_cursor, keyset
+from pamps.routes.post import POST_KEY
+
+
+def collect_pages(client, url, limit, **extra):
+    items, params = [], {"limit": limit, **extra}
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= limit
+        items.extend(page)
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            return items
+        params["cursor"] = cursor
+
+
+def test_post_pages_follow_date_and_id_order(api_client_user_1):
+    for n in range(5):
+        api_client_user_1.post("/post/", json={"text": f"page {n}"})
+
+    everything = api_client_user_1.get("/post/", params={"limit": 100}).json()
+    paged = collect_pages(api_client_user_1, "/post/", limit=2)
+
+    assert [post["id"] for post in paged] == [post["id"] for post in everything]
+    keys = [(post["date"], post["id"]) for post in paged]
+    assert keys == sorted(keys)
+
+
+def test_post_pages_can_be_read_newest_first(api_client_user_1):
+    for n in range(3):
+        api_client_user_1.post("/post/", json={"text": f"newest {n}"})
+
+    oldest_first = collect_pages(api_client_user_1, "/post/user/user_1/", limit=2)
+    newest_first = collect_pages(
+        api_client_user_1, "/post/user/user_1/", limit=2, order="desc"
+    )
+    assert newest_first == oldest_first[::-1]
+
+    response = api_client_user_1.get("/post/", params={"order": "sideways"})
+    assert response.status_code == 422
+
+
+def test_user_pages_follow_id_order(api_client_user_1, api_client_user_2):
+    users = collect_pages(api_client_user_1, "/user/", limit=1)
+    assert len(users) >= 2
+    assert len({user["username"] for user in users}) == len(users)
+
+
+def test_invalid_cursor_and_limit_are_rejected(api_client):
+    response = api_client.get("/post/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+    response = api_client.get("/post/", params={"limit": 1000})
+    assert response.status_code == 422
+
+
+def test_cursor_bounds_the_leading_column():
+    page = PageParams(cursor=encode_cursor([datetime(2026, 1, 1), 2]), limit=5)
+    sql = str(keyset(select(Post), POST_KEY, page))
+    assert "(post.date, post.id) > (:param_1, :param_2)" in sql
+    assert "post.date >= :date_1" in sql
@@ -0,0 +1,56 @@
+from datetime import date
+
+from pamps import partitions
+from pamps.db import engine
+
+
+def test_monthly_partition_names_and_bounds():
+    assert partitions.add_months((2026, 11), 2) == (2027, 1)
+    assert partitions.add_months((2026, 1), -1) == (2025, 12)
+    assert partitions.partition_name((2026, 3)) == "post_y2026m03"
+    assert partitions.partition_month("post_y2026m03") == (2026, 3)
+    assert partitions.partition_month("post_default") is None
+    assert partitions.create_partition_sql((2026, 12)) == (
+        "CREATE TABLE IF NOT EXISTS post_y2026m12 PARTITION OF post "
+        "FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')"
+    )
+
+
+def test_helpers_do_nothing_on_a_plain_post_table(cli, cli_client):
+    with engine.begin() as connection:
+        assert not partitions.is_partitioned(connection)
+        assert partitions.create_partitions(connection, 3) == []
+        assert partitions.archive_partitions(connection, date.today()) == []
+
+    result = cli_client.invoke(cli, ["create-partitions"])
+    assert result.exit_code == 1
+    assert "not partitioned" in result.output
+
+
+def test_post_months_bound_lookups_by_id():
+    months = partitions.PostMonths()
+    assert months.conditions([1]) == []
+
+    months.months = [(1, 10, date(2026, 8, 1)), (11, 20, date(2026, 9, 1))]
+    assert months.date_range([3]) == (date(2026, 8, 1), date(2026, 9, 1))
+    assert months.date_range([3, 15]) == (date(2026, 8, 1), date(2026, 10, 1))
+    # newer than the snapshot: the newest month or a later one
+    assert months.date_range([15, 25]) == (date(2026, 9, 1), None)
+    assert months.date_range([25]) == (date(2026, 9, 1), None)
+    assert len(months.conditions([25])) == 1
+    assert len(months.conditions([3])) == 2
+
+    # posts of the default partition can have any date
+    months.default = (21, 22)
+    assert months.date_range([21]) is None
+    months.default = None
+    months.months.append((30, 40, date(2026, 11, 1)))
+    assert months.date_range([25]) is None
+
+
+def test_replies_to_missing_posts_are_rejected(api_client_user_1):
+    # post.parent_id has no foreign key once post is partitioned
+    response = api_client_user_1.post(
+        "/post/", json={"text": "orphan", "parent_id": 999999}
+    )
+    assert response.status_code == 404
@@ -0,0 +1,101 @@
+"""Guards the indexes the route queries depend on, planning the queries
+the routes build"""
+from datetime import datetime
+
+import pytest
+from sqlmodel import select
+
+from pamps.db import engine
+from pamps.models import Like
+from pamps.pagination import PageParams, encode_cursor
+from pamps.routes import post, user
+from pamps.threads import thread_query
+from pamps.timeline import timeline_query
+from pamps.typeahead import prefix_query
+
+PAGE = PageParams(limit=20)
+# the pages after the first also carry the keyset predicate
+POST_PAGE = PageParams(limit=20, cursor=encode_cursor([datetime(2026, 1, 1), 5]))
+NEWEST_PAGE = PageParams(
+    limit=20, cursor=encode_cursor([datetime(2026, 1, 1), 5]), descending=True
+)
+USER_PAGE = PageParams(limit=20, cursor=encode_cursor([5]))
+
+
+def query_plan(query) -> str:
+    sql = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.mark.parametrize(
+    "page", [PAGE, POST_PAGE, NEWEST_PAGE], ids=["first", "next", "newest"]
+)
+@pytest.mark.parametrize(
+    "build, indexes",
+    [
+        (post.list_posts_query, ["ix_post_parent_id_date_id"]),
+        (
+            lambda page: post.user_posts_query("user_1", False, page),
+            ["sqlite_autoindex_user_2", "ix_post_user_id_date_id"],
+        ),
+        (
+            lambda page: post.user_posts_query("user_1", True, page),
+            ["sqlite_autoindex_user_2", "ix_post_user_id_date_id"],
+        ),
+    ],
+    ids=["posts", "user-posts", "user-posts-with-replies"],
+)
+def test_post_lists_walk_an_index_in_page_order(build, indexes, page):
+    plan = query_plan(build(page))
+    for index in indexes:
+        assert f"INDEX {index}" in plan
+    assert "USE TEMP B-TREE" not in plan
+
+
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (post.tag_posts_query("x", POST_PAGE), "ix_hashtag_tag_post_id"),
+        (post.mention_posts_query("user_1", POST_PAGE), "ix_mention_user_id_post_id"),
+        (post.liked_posts_query("user_1", POST_PAGE), "sqlite_autoindex_like_1"),
+    ],
+    ids=["tag", "mentions", "likes"],
+)
+def test_joined_post_lists_use_an_index(query, index):
+    # these sort the matches of the tag, user or likes by post date, the
+    # index bounds how many rows are sorted
+    assert f"INDEX {index}" in query_plan(query)
+
+
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (user.followers_query(1, USER_PAGE), "ix_social_to_id_from_id"),
+        (user.following_query(1, USER_PAGE), "sqlite_autoindex_social_1"),
+        (thread_query(1, 5, []), "ix_post_parent_id_date_id"),
+        (thread_query(1, 5, [], max_breadth=3), "ix_post_parent_id_date_id"),
+        (timeline_query(1, datetime(2026, 1, 1)), "ix_post_parent_id_date_id"),
+        (select(Like).where(Like.post_id == 1), "ix_like_post_id"),
+        (
+            select(Like).where(Like.user_id == 1, Like.post_id == 1),
+            "sqlite_autoindex_like_1",
+        ),
+        (prefix_query("sqlite", "us", 21), "ix_user_username_prefix"),
+    ],
+    ids=[
+        "followers",
+        "following",
+        "thread",
+        "thread-breadth",
+        "timeline",
+        "post-likes",
+        "like-lookup",
+        "typeahead",
+    ],
+)
+def test_hot_queries_use_an_index(query, index):
+    plan = query_plan(query)
+    assert f"INDEX {index}" in plan
+    assert "USE TEMP B-TREE" not in plan
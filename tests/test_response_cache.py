@@ -0,0 +1,138 @@
+import asyncio
+import fnmatch
+
+import pytest
+from fastapi import Request, Response
+
+from pamps.response_cache import MemoryBackend, RedisBackend, response_cache
+
+
+class LocalRedis:
+    """Stand-in for the few Redis commands the cache backend uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+    async def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(members)
+
+    async def smembers(self, key):
+        return set(self.data.get(key, ()))
+
+    async def expire(self, key, seconds):
+        pass
+
+    async def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def scan_iter(self, pattern):
+        for key in fnmatch.filter(list(self.data), pattern):
+            yield key
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache_backend(request, monkeypatch):
+    if request.param == "redis":
+        monkeypatch.setattr(
+            response_cache, "backend", RedisBackend(client=LocalRedis(), hold=5)
+        )
+
+
+def test_reads_are_served_with_etag_and_304(cache_backend, api_client_user_1):
+    post_id = api_client_user_1.post("/post/", json={"text": "etag"}).json()["id"]
+
+    first = api_client_user_1.get(f"/post/{post_id}/")
+    hits = response_cache.hits
+    second = api_client_user_1.get(f"/post/{post_id}/")
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert response_cache.hits == hits + 1
+
+    response = api_client_user_1.get(
+        f"/post/{post_id}/", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_writes_invalidate_tagged_entries(
+    cache_backend, api_client_user_1, api_client_user_2
+):
+    post_id = api_client_user_1.post("/post/", json={"text": "tagged"}).json()["id"]
+    before = api_client_user_1.get(f"/post/{post_id}/")
+    listing = api_client_user_1.get("/post/user/user_1/", params={"limit": 100})
+
+    api_client_user_2.post(f"/post/{post_id}/like/")
+
+    after = api_client_user_1.get(f"/post/{post_id}/")
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json()["like_count"] == 1
+    relisted = api_client_user_1.get("/post/user/user_1/", params={"limit": 100})
+    assert relisted.headers["ETag"] != listing.headers["ETag"]
+
+
+def test_new_users_are_visible_right_away(api_client):
+    assert api_client.get("/user/cache_user/").status_code == 404
+    api_client.post(
+        "/user/",
+        json={"email": "cache@pamps.com", "username": "cache_user", "password": "x"},
+    )
+    response = api_client.get("/user/cache_user/")
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+
+
+def test_memory_backend_unlinks_evicted_and_expired_keys():
+    backend = MemoryBackend(max_size=2, ttl=60)
+
+    async def fill():
+        await backend.set("a", {}, ["post:1", "user:1"])
+        await backend.set("b", {}, ["post:1"])
+        await backend.set("c", {}, ["post:2"])  # evicts a
+        assert backend._tags == {"post:1": {"b"}, "post:2": {"c"}}
+
+        backend.entries.ttl = -1
+        await backend.set("c", {}, ["post:3"])
+        assert await backend.get("c") is None  # expired
+        assert backend._tags == {"post:1": {"b"}}
+        assert set(backend._key_tags) == {"b"}
+
+    asyncio.run(fill())
+
+
+def test_replica_reads_of_invalidated_tags_are_not_stored(cache_backend):
+    def request(read_replica):
+        request = Request(
+            {"type": "http", "path": "/post/held/", "query_string": b"", "headers": []}
+        )
+        request.state.read_replica = read_replica
+        return request
+
+    async def scenario():
+        await response_cache.invalidate("post:held")
+        stale = await response_cache.store_body(
+            request(True), Response(), b'{"stale": true}', {"post:held"}
+        )
+        assert stale.body == b'{"stale": true}'
+        assert await response_cache.lookup(request(False)) is None
+
+        # the primary has the write, its rows can be cached
+        await response_cache.store_body(
+            request(False), Response(), b'{"fresh": true}', {"post:held"}
+        )
+        cached = await response_cache.lookup(request(True))
+        assert cached.body == b'{"fresh": true}'
+
+    held = response_cache.held
+    asyncio.run(scenario())
+    assert response_cache.held == held + 1
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from pamps.pagination import NEXT_CURSOR_HEADER
+
+
+def search(client, **params):
+    response = client.get("/post/search/", params=params)
+    assert response.status_code == 200
+    return response
+
+
+def test_search_ranks_matches_and_pages_through_them(api_client_user_1):
+    ids = [
+        api_client_user_1.post("/post/", json={"text": text}).json()["id"]
+        for text in (
+            "a quokka walks into a bar",
+            "quokka quokka quokka, everywhere a quokka",
+            "nothing to see here",
+        )
+    ]
+
+    seen, params = [], {"q": "Quokka!", "limit": 1}
+    while True:
+        response = search(api_client_user_1, **params)
+        seen.extend(post["id"] for post in response.json())
+        if NEXT_CURSOR_HEADER not in response.headers:
+            break
+        params["cursor"] = response.headers[NEXT_CURSOR_HEADER]
+
+    assert seen == [ids[1], ids[0]]
+    assert search(api_client_user_1, q="quokka bar").json()[0]["id"] == ids[0]
+    assert search(api_client_user_1, q="***").json() == []
+
+
+def test_search_filters_by_username_and_date(api_client_user_1, api_client_user_2):
+    api_client_user_1.post("/post/", json={"text": "wombat by one"})
+    api_client_user_2.post("/post/", json={"text": "wombat by two"})
+
+    posts = search(api_client_user_1, q="wombat", username="user_2").json()
+    assert [post["text"] for post in posts] == ["wombat by two"]
+
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    assert len(search(api_client_user_1, q="wombat", until=tomorrow).json()) == 2
+    assert search(api_client_user_1, q="wombat", since=tomorrow).json() == []
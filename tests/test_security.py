@@ -0,0 +1,26 @@
+from pamps.security import HashedPassword, hashing_pool, verify_password
+
+
+def test_login_is_rejected_with_503_when_hashing_pool_is_saturated(
+    api_client, api_client_user_1
+):
+    max_pending = hashing_pool.max_pending
+    hashing_pool.max_pending = 0
+    try:
+        response = api_client.post(
+            "/token",
+            data={"username": "user_1", "password": "user_1"},
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+    finally:
+        hashing_pool.max_pending = max_pending
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert hashing_pool.stats()["rejected"] >= 1
+
+
+def test_hashed_password_is_not_hashed_twice():
+    hashed = HashedPassword.validate("secret")
+    assert HashedPassword.validate(hashed) is hashed
+    assert verify_password("secret", hashed)
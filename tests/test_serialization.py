@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+from sqlmodel import Session, select
+
+from pamps.db import async_session_factory, engine
+from pamps.loaders import Loaders
+from pamps.models import Post, User
+from pamps.models.post import PostResponse
+from pamps.models.user import UserResponse
+from pamps.serialization import encode_rows, response_columns
+
+
+def model_body(model, content) -> bytes:
+    return JSONResponse(jsonable_encoder(parse_obj_as(model, content))).body
+
+
+def test_fast_path_matches_the_response_model_bytes(api_client_user_1):
+    with Session(engine) as session:
+        posts = [
+            Post(text=text, date=date, user_id=1)
+            for text, date in (
+                ('quotes " and \\ and é ü 漢字 🎉', datetime(2026, 1, 2, 3, 4, 5)),
+                ("controls \n\t\x01\x1f and  ", datetime(2026, 1, 2, 3, 4, 5, 6)),
+            )
+        ]
+        session.add_all(posts)
+        session.commit()
+        ids = [post.id for post in posts]
+
+        query = select(*response_columns(PostResponse, Post)).where(Post.id.in_(ids))
+        rows = session.execute(query.order_by(Post.id)).all()
+        posts = session.exec(
+            select(Post).where(Post.id.in_(ids)).order_by(Post.id)
+        ).all()
+        author = session.get(User, 1)
+        posts = [
+            {**post.dict(), "author": {"username": author.username, "avatar": None}}
+            for post in posts
+        ]
+        assert asyncio.run(encode_posts(rows)) == model_body(List[PostResponse], posts)
+
+        query = select(*response_columns(UserResponse, User), User.id)
+        rows = session.execute(query.order_by(User.id)).all()
+        users = session.exec(select(User).order_by(User.id)).all()
+        assert encode_rows(rows, UserResponse) == model_body(List[UserResponse], users)
+
+
+async def encode_posts(rows) -> bytes:
+    async with async_session_factory() as session:
+        return await Loaders(session).encode_posts(rows)
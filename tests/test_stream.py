@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from pamps.broker import Broker
+from pamps.broker import broker as app_broker
+from pamps.db import async_pool_metrics
+from pamps.routes.stream import server_sent_events, stream_thread
+
+
+def test_slow_subscribers_are_dropped():
+    broker = Broker(queue_size=2)
+
+    async def publish():
+        slow = broker.subscribe(["user:1"])
+        other = broker.subscribe(["user:2"])
+        for n in range(3):
+            await broker.publish("user:1", b"%d" % n)
+        await broker.publish("user:2", b"kept")
+        assert await slow.get() is None
+        assert await other.get() == b"kept"
+
+    asyncio.run(publish())
+    assert broker.stats()["dropped"] == 1
+    assert broker.stats()["subscribers"] == 1
+
+
+def test_messages_from_other_threads_reach_the_subscriber_loop():
+    broker = Broker()
+
+    async def receive():
+        subscription = broker.subscribe(["thread:1"])
+        thread = threading.Thread(target=broker.deliver, args=("thread:1", b"hi"))
+        thread.start()
+        assert await asyncio.wait_for(subscription.get(), 5) == b"hi"
+        thread.join()
+
+    asyncio.run(receive())
+
+
+def test_subscribers_of_closed_loops_are_dropped():
+    broker = Broker()
+
+    async def subscribe():
+        return broker.subscribe(["user:1"])
+
+    dead = asyncio.run(subscribe())
+
+    async def publish():
+        alive = broker.subscribe(["user:1"])
+        await broker.publish("user:1", b"hi")
+        assert await alive.get() == b"hi"
+
+    asyncio.run(publish())
+    assert dead.closed
+    assert broker.stats()["dropped"] == 1
+
+
+def test_server_sent_events_format_and_keepalive(settings, monkeypatch):
+    monkeypatch.setitem(settings.stream, "keepalive_seconds", 0.01)
+    broker = Broker()
+
+    class Request:
+        async def is_disconnected(self):
+            return False
+
+    async def stream():
+        subscription = broker.subscribe(["user:1"])
+        events = server_sent_events(Request(), subscription)
+        assert await events.__anext__() == b": keepalive\n\n"
+        await broker.publish("user:1", b'{"id":1}')
+        assert await events.__anext__() == b'event: post\ndata: {"id":1}\n\n'
+        await events.aclose()
+        assert subscription.closed
+
+    asyncio.run(stream())
+
+
+def test_websockets_push_new_posts(api_client, api_client_user_1, api_client_user_2):
+    api_client_user_1.post("/user/follow/2/")
+    token = api_client_user_1.headers["Authorization"].split()[1]
+    root = api_client_user_1.post("/post/", json={"text": "watched"}).json()["id"]
+
+    with api_client.websocket_connect(
+        f"/stream/thread/{root}/ws/"
+    ) as thread, api_client.websocket_connect(
+        f"/stream/feed/ws/?token={token}"
+    ) as feed:
+        new = api_client_user_2.post("/post/", json={"text": "for followers"}).json()
+        assert json.loads(feed.receive_text()) == new
+
+        reply = api_client_user_2.post(
+            "/post/", json={"text": "reply", "parent_id": root}
+        ).json()
+        assert json.loads(thread.receive_text())["id"] == reply["id"]
+        assert json.loads(feed.receive_text())["id"] == reply["id"]
+        nested = api_client_user_1.post(
+            "/post/", json={"text": "nested", "parent_id": reply["id"]}
+        ).json()
+        assert json.loads(thread.receive_text())["id"] == nested["id"]
+
+
+def test_websocket_rejects_bad_tokens_and_unknown_posts(api_client):
+    for url in ("/stream/feed/ws/?token=bad", "/stream/thread/999999/ws/"):
+        with pytest.raises(WebSocketDisconnect) as error:
+            with api_client.websocket_connect(url):
+                pass
+        assert error.value.code == 1008
+
+
+def test_open_event_streams_hold_no_connection(api_client_user_1):
+    root = api_client_user_1.post("/post/", json={"text": "sse"}).json()["id"]
+
+    async def open_stream():
+        checked_out = async_pool_metrics.stats()["checked_out"]
+        response = await stream_thread(post_id=root, request=None)
+        assert async_pool_metrics.stats()["checked_out"] == checked_out
+        assert response.media_type == "text/event-stream"
+        (subscription,) = app_broker._topics[f"thread:{root}"]
+        subscription.close()
+
+    asyncio.run(open_stream())
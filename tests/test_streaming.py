@@ -0,0 +1,52 @@
+import json
+
+import pytest
+from fastapi import Request
+
+from pamps.pagination import NEXT_CURSOR_HEADER
+from pamps.streaming import NDJSON_MEDIA_TYPE, wants_ndjson
+
+NDJSON = {"Accept": f"{NDJSON_MEDIA_TYPE}, application/json;q=0.5"}
+
+
+def read_ndjson(response):
+    assert response.status_code == 200
+    assert response.headers["content-type"] == NDJSON_MEDIA_TYPE
+    assert NEXT_CURSOR_HEADER not in response.headers
+    return [json.loads(line) for line in response.content.splitlines()]
+
+
+def test_lists_stream_every_row_as_ndjson(api_client_user_1, settings, monkeypatch):
+    for n in range(3):
+        api_client_user_1.post("/post/", json={"text": f"streamed {n}"})
+    monkeypatch.setitem(settings.streaming, "yield_per", 2)
+
+    posts = api_client_user_1.get("/post/", headers=NDJSON, params={"limit": 1})
+    paged = api_client_user_1.get("/post/", params={"limit": 100}).json()
+    assert read_ndjson(posts) == paged
+
+    mine = read_ndjson(api_client_user_1.get("/post/user/user_1/", headers=NDJSON))
+    assert {post["user_id"] for post in mine} == {1}
+    assert mine[-1]["text"] == "streamed 2"
+
+    users = read_ndjson(api_client_user_1.get("/user/", headers=NDJSON))
+    assert "user_1" in {user["username"] for user in users}
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (NDJSON_MEDIA_TYPE, True),
+        (f"{NDJSON_MEDIA_TYPE}, application/json;q=0.5", True),
+        (f"application/json, {NDJSON_MEDIA_TYPE}", True),
+        (f"{NDJSON_MEDIA_TYPE};q=0", False),
+        (f"{NDJSON_MEDIA_TYPE};q=0.2, */*;q=0.8", False),
+        (f"{NDJSON_MEDIA_TYPE}; q=0.9, application/json;q=0.1", True),
+        ("application/json", False),
+        ("*/*", False),
+        ("", False),
+    ],
+)
+def test_ndjson_is_chosen_by_q_value(accept, expected):
+    scope = {"type": "http", "headers": [(b"accept", accept.encode())]}
+    assert wants_ndjson(Request(scope)) is expected
@@ -0,0 +1,39 @@
+from sqlmodel import Session, select
+
+from pamps.db import engine
+from pamps.models import Hashtag, Post
+from pamps.tags import extract_hashtags, extract_mentions
+
+
+def test_extracts_hashtags_and_mentions():
+    text = "#Python and #python, mail me@example.com ##x @user_2 @user_2!"
+    assert extract_hashtags(text) == {"python"}
+    assert extract_mentions(text) == {"user_2"}
+
+
+def test_posts_are_found_by_tag_and_mention(api_client_user_1):
+    post = api_client_user_1.post(
+        "/post/", json={"text": "#Tagged for @user_2 and @nobody"}
+    ).json()
+
+    for url in ("/post/tag/tagged/", "/post/tag/TAGGED/", "/post/mentions/user_2/"):
+        response = api_client_user_1.get(url)
+        assert response.status_code == 200
+        assert [found["id"] for found in response.json()] == [post["id"]]
+    assert api_client_user_1.get("/post/mentions/user_1/").json() == []
+
+
+def test_backfill_tags_indexes_existing_posts(cli, cli_client):
+    with Session(engine) as session:
+        post = Post(text="#backfilled by @user_1", user_id=1)
+        session.add(post)
+        session.commit()
+        post_id = post.id
+
+    for _ in range(2):  # indexing again is a no-op
+        result = cli_client.invoke(cli, ["backfill-tags", "--batch-size", "2"])
+        assert result.exit_code == 0
+
+    with Session(engine) as session:
+        tags = session.exec(select(Hashtag).where(Hashtag.post_id == post_id)).all()
+        assert [tag.tag for tag in tags] == ["backfilled"]
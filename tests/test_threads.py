@@ -0,0 +1,79 @@
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session
+
+from pamps.db import async_engine, engine
+from pamps.threads import thread_query
+
+
+def reply(client, parent_id, text):
+    response = client.post("/post/", json={"text": text, "parent_id": parent_id})
+    return response.json()["id"]
+
+
+def test_thread_is_nested_and_loaded_in_one_query(
+    api_client, api_client_user_1, api_client_user_2
+):
+    root = reply(api_client_user_1, None, "root")
+    first = reply(api_client_user_2, root, "first")
+    second = reply(api_client_user_1, root, "second")
+    nested = reply(api_client_user_1, first, "nested")
+    deepest = reply(api_client_user_2, nested, "deepest")
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        response = api_client.get(f"/post/{root}/thread/")
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+    assert response.status_code == 200
+    # the thread, then the authors of all its posts in one batch
+    assert len(statements) == 2
+    assert statements[1].count("?") == 2
+    thread = response.json()
+    assert [post["id"] for post in thread["replies"]] == [first, second]
+    first_reply = thread["replies"][0]
+    assert first_reply["replies"][0]["id"] == nested
+    assert first_reply["replies"][0]["replies"][0]["id"] == deepest
+    assert first_reply["replies"][0]["replies"][0]["depth"] == 3
+
+
+def test_thread_depth_and_breadth_limits(api_client, api_client_user_1):
+    root = reply(api_client_user_1, None, "limited root")
+    child = reply(api_client_user_1, root, "child 1")
+    reply(api_client_user_1, root, "child 2")
+    grandchild = reply(api_client_user_1, child, "grandchild")
+
+    thread = api_client.get(
+        f"/post/{root}/thread/", params={"max_depth": 1, "max_breadth": 1}
+    ).json()
+    assert [post["id"] for post in thread["replies"]] == [child]
+    assert thread["replies"][0]["replies"] == []
+
+    # replies past the breadth are not read at all
+    with Session(engine) as session:
+        rows = session.execute(thread_query(root, 5, [], max_breadth=1)).all()
+    assert sorted((depth, post.id) for post, depth in rows) == [
+        (0, root),
+        (1, child),
+        (2, grandchild),
+    ]
+
+
+def test_thread_of_missing_post_is_404(api_client):
+    assert api_client.get("/post/999999/thread/").status_code == 404
+
+
+def test_thread_breadth_limit_compiles_for_postgres():
+    query = thread_query(1, 5, [], max_breadth=2)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+    assert "WITH RECURSIVE thread" in sql
+    # Postgres rejects a reference to the recursive CTE inside a subquery
+    subquery = sql[sql.index("IN (SELECT") :]
+    subquery = subquery[: subquery.index("LIMIT")]
+    assert "thread" not in subquery
@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from pamps.trending import Leaderboard, trending
+
+
+def test_scores_decay_with_half_life():
+    board = Leaderboard(half_life=10)
+    now = board.epoch
+    board.add(1, datetime.utcnow(), weight=4, at=now)
+    board.add(2, datetime.utcnow(), weight=1, at=now + 20)
+
+    assert board.score(1, now + 20) == board.score(2, now + 20) == 1
+    board.add(2, datetime.utcnow(), weight=1, at=now + 10_000)  # rebased
+    assert board.score(2, now + 10_000) == 1
+    assert board.ranking() == [2, 1]
+
+
+def test_trending_ranks_posts_by_new_likes_and_replies(
+    api_client_user_1, api_client_user_2
+):
+    quiet, busy = [
+        api_client_user_1.post("/post/", json={"text": text}).json()["id"]
+        for text in ("quiet", "busy")
+    ]
+    api_client_user_2.post("/post/", json={"text": "re", "parent_id": busy})
+    api_client_user_2.post(f"/post/{quiet}/like/")
+    api_client_user_1.post(f"/post/{busy}/like/")
+
+    asyncio.run(trending.refresh())
+    response = api_client_user_1.get("/post/trending/", params={"limit": 100})
+    assert response.status_code == 200
+    ids = [post["id"] for post in response.json()]
+    assert ids.index(busy) < ids.index(quiet)
+
+    score = trending.score(busy)
+    asyncio.run(trending.refresh())  # nothing new is folded twice
+    assert trending.score(busy) <= score
+    assert [post.id for post in trending.top(100)] == ids
+
+
+def test_relike_does_not_raise_the_score(api_client_user_1, api_client_user_2):
+    post = api_client_user_1.post("/post/", json={"text": "relike"}).json()["id"]
+    api_client_user_2.post(f"/post/{post}/like/")
+    asyncio.run(trending.refresh())
+    score = trending.score(post)
+    assert score > 0
+
+    for _ in range(3):
+        api_client_user_2.delete(f"/post/{post}/like/")
+        asyncio.run(trending.refresh())
+        api_client_user_2.post(f"/post/{post}/like/")
+        asyncio.run(trending.refresh())
+    assert trending.score(post) == pytest.approx(score, rel=1e-3)
+
+
+def test_unlike_takes_the_like_back():
+    board = Leaderboard(half_life=10)
+    now = board.epoch
+    board.update(1, datetime.utcnow(), likes=2, replies=1, at=now)
+    assert board.score(1, now) == 4
+    board.update(1, datetime.utcnow(), likes=0, replies=1, at=now)
+    assert board.score(1, now) == 2
@@ -0,0 +1,85 @@
+from pamps.typeahead import Matches, PrefixIndex, prefix_index
+
+from .conftest import create_api_client_authenticated
+
+
+def usernames(response):
+    return [user["username"] for user in response.json()]
+
+
+def matches(users, complete):
+    return Matches([user["username"] for user in users], users, complete)
+
+
+def test_search_users_by_prefix(api_client, monkeypatch):
+    monkeypatch.setattr(prefix_index, "max_results", 2)
+    prefix_index.cache.clear()
+    for name, user_id in [("Typo_b", 81), ("typo_a", 82), ("typist", 83)]:
+        create_api_client_authenticated(name, user_id)
+
+    response = api_client.get("/user/search/", params={"prefix": "TYP"})
+    assert response.status_code == 200
+    assert usernames(response) == ["typist", "typo_a"]
+    assert not prefix_index.lookup("typ").complete
+
+    queries = prefix_index.queries
+    response = api_client.get("/user/search/", params={"prefix": "typo"})
+    assert usernames(response) == ["typo_a", "Typo_b"]
+    assert prefix_index.lookup("typo").complete
+    # answered from the complete results of "typo"
+    response = api_client.get("/user/search/", params={"prefix": "typo_b"})
+    assert usernames(response) == ["Typo_b"]
+    assert prefix_index.queries == queries + 1
+
+    api_client.post(
+        "/user/",
+        json={
+            "email": "typo_c@pamps.com",
+            "username": "typo_c",
+            "password": "typo_c",
+        },
+    )
+    assert prefix_index.lookup("typo") is None
+    response = api_client.get("/user/search/", params={"prefix": "typo", "limit": 1})
+    assert usernames(response) == ["typo_a"]
+
+    assert api_client.get("/user/search/").status_code == 422
+    assert api_client.get("/user/search/", params={"prefix": "zzzz"}).json() == []
+
+
+def test_lookup_narrows_complete_results():
+    index = PrefixIndex(max_results=5)
+    users = [{"username": name} for name in ("ab", "abc", "abd", "b")]
+    index.cache.set("a", matches(users[:3], complete=True))
+    index.cache.set("b", matches(users[3:], complete=False))
+
+    assert index.lookup("abc").users == [{"username": "abc"}]
+    assert index.lookup("ax").users == []
+    assert index.lookup("bc") is None
+    index.invalidate("ABX")
+    assert index.lookup("abc").users == [{"username": "abc"}]  # kept under "abc"
+    assert index.lookup("a") is None
+
+
+def test_non_ascii_prefixes_and_follow_counts(api_client):
+    prefix_index.cache.clear()
+    follower = create_api_client_authenticated("typeahead_fan", 86)
+    ids = {}
+    for name in ("Émile", "éloi"):
+        response = api_client.post(
+            "/user/",
+            json={"email": f"{name}@pamps.com", "username": name, "password": name},
+        )
+        ids[name] = response.json()["id"]
+
+    response = api_client.get("/user/search/", params={"prefix": "É"})
+    assert usernames(response) == ["éloi", "Émile"]
+    response = api_client.get("/user/search/", params={"prefix": "ém"})
+    assert usernames(response) == ["Émile"]
+    assert response.json()[0]["follower_count"] == 0
+
+    # the cached result carries the follower count, the follow drops it
+    follower.post(f"/user/follow/{ids['Émile']}/")
+    assert prefix_index.lookup("ém") is None
+    response = api_client.get("/user/search/", params={"prefix": "ém"})
+    assert response.json()[0]["follower_count"] == 1